@@ -0,0 +1,202 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from rq import Worker
+from rq.exceptions import NoSuchJobError
+from rq.job import Job as RQJob
+from rq.utils import utcnow
+
+queue_high_watermark = int(os.getenv("INGRESS_QUEUE_HIGH", "10000"))
+queue_low_watermark = int(os.getenv("INGRESS_QUEUE_LOW", "8000"))
+age_high_watermark = float(os.getenv("INGRESS_MAX_AGE_HIGH", "900"))
+age_low_watermark = float(os.getenv("INGRESS_MAX_AGE_LOW", "600"))
+client_rate = float(os.getenv("INGRESS_CLIENT_RATE", "5"))
+client_burst = float(os.getenv("INGRESS_CLIENT_BURST", "20"))
+# Peers whose X-Client-Id / X-Forwarded-For headers are believed, e.g. the ingress proxy
+trusted_proxies = {address.strip() for address in os.getenv("INGRESS_TRUSTED_PROXIES", "").split(",") if address.strip()}
+
+
+def client_id(peer, headers, trusted=trusted_proxies):
+    # Anyone can send headers, so rate limits are keyed on the peer address
+    # unless the request came through a proxy that sets them
+    if peer in trusted:
+        forwarded = headers.get("X-Forwarded-For", "").split(",")[-1].strip()
+        return headers.get("X-Client-Id") or forwarded or peer
+    return peer or "unknown"
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        # Seconds until the next token is available
+        return math.ceil((1 - self.tokens) / self.rate)
+
+
+class AdmissionController:
+    # Sheds load once the queue crosses the high watermarks and keeps shedding
+    # until it has drained below the low ones, so producers back off for a
+    # while instead of flapping right at the limit
+
+    def __init__(
+        self,
+        queue,
+        high_watermark=queue_high_watermark,
+        low_watermark=queue_low_watermark,
+        age_high=age_high_watermark,
+        age_low=age_low_watermark,
+        rate=client_rate,
+        burst=client_burst,
+        max_clients=10000,
+        sample_interval=1.0,
+        rate_window=60.0,
+    ):
+        self.queue = queue
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.age_high = age_high
+        self.age_low = age_low
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.sample_interval = sample_interval
+        self.rate_window = rate_window
+
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+        self.shedding = False
+        self.shed_reason = None
+        self.accepted = 0
+        self.rejected = {"queue_depth": 0, "queue_age": 0, "rate_limit": 0}
+        self.enqueued = deque()
+
+        self.depth = 0
+        self.oldest_age = 0.0
+        self.sampled_at = 0.0
+        # (completed jobs, time) samples over the last rate_window seconds
+        self.completions = deque()
+        self.completion_rate = 0.0
+
+    def _oldest_age(self):
+        job_ids = self.queue.get_job_ids(0, 0)
+        if not job_ids:
+            return 0.0
+        try:
+            job = RQJob.fetch(job_ids[0], connection=self.queue.connection)
+        except NoSuchJobError:
+            # Deleted or expired while still listed, the next sample sees the new head
+            return 0.0
+        if not job.enqueued_at:
+            return 0.0
+        return max(0.0, (utcnow() - job.enqueued_at).total_seconds())
+
+    def _completed_jobs(self):
+        return sum(worker.successful_job_count for worker in Worker.all(queue=self.queue))
+
+    def sample(self, force=False):
+        # Reading the queue costs Redis round trips, so do it at most once
+        # per sample_interval no matter how many requests arrive
+        now = time.monotonic()
+        if not force and now - self.sampled_at < self.sample_interval:
+            return
+
+        self.depth = self.queue.count
+        self.oldest_age = self._oldest_age()
+
+        self.completions.append((self._completed_jobs(), now))
+        # Keep one sample from before the window as the baseline, so a quiet
+        # spell without requests still leaves a rate to go on
+        while len(self.completions) > 2 and now - self.completions[1][1] >= self.rate_window:
+            self.completions.popleft()
+        self.completion_rate = self._completion_rate()
+        self.sampled_at = now
+
+        if self.depth >= self.high_watermark:
+            self.shedding, self.shed_reason = True, "queue_depth"
+        elif self.oldest_age >= self.age_high:
+            self.shedding, self.shed_reason = True, "queue_age"
+        elif self.depth <= self.low_watermark and self.oldest_age <= self.age_low:
+            self.shedding, self.shed_reason = False, None
+
+    def _completion_rate(self):
+        if len(self.completions) < 2:
+            return 0.0
+        # Worker restarts reset their counters, so only increases count
+        completed = sum(
+            max(0, count - previous)
+            for (previous, _), (count, _) in zip(self.completions, list(self.completions)[1:])
+        )
+        return completed / (self.completions[-1][1] - self.completions[0][1])
+
+    def _retry_after(self):
+        excess = max(1, self.depth - self.low_watermark)
+        if self.completion_rate > 0:
+            return min(300, max(1, math.ceil(excess / self.completion_rate)))
+        return 30
+
+    def _bucket(self, client):
+        bucket = self.buckets.get(client)
+        if bucket is None:
+            bucket = self.buckets[client] = TokenBucket(self.rate, self.burst)
+            if len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(client)
+        return bucket
+
+    def admit(self, client):
+        # Returns (retry_after, reason); retry_after is 0 when the request is admitted
+        with self.lock:
+            self.sample()
+
+            if self.shedding:
+                self.rejected[self.shed_reason] += 1
+                return self._retry_after(), self.shed_reason
+
+            retry_after = self._bucket(client).take()
+            if retry_after:
+                self.rejected["rate_limit"] += 1
+                return retry_after, "rate_limit"
+
+            self.accepted += 1
+            self.enqueued.append(time.monotonic())
+            return 0, None
+
+    def metrics(self):
+        with self.lock:
+            # Not forced, scrapes must not shorten the sampling interval
+            self.sample()
+
+            now = time.monotonic()
+            while self.enqueued and now - self.enqueued[0] > 60:
+                self.enqueued.popleft()
+
+            return {
+                "queue_depth": self.depth,
+                "oldest_job_age_seconds": self.oldest_age,
+                "shedding": self.shedding,
+                "shed_reason": self.shed_reason,
+                "high_watermark": self.high_watermark,
+                "low_watermark": self.low_watermark,
+                "accepted_total": self.accepted,
+                "rejected_total": dict(self.rejected),
+                "enqueue_rate_per_second": len(self.enqueued) / 60,
+                "completion_rate_per_second": self.completion_rate,
+                "tracked_clients": len(self.buckets),
+            }
@@ -1,5 +1,6 @@
 from arango import ArangoClient
-import json
+from graph_batch import Edge, GraphBatch, Node
+from mentions import fold_salience
 
 class ArangoDBGraphMerger:
     def __init__(self, host, port, database, username, password):
@@ -8,9 +9,9 @@ class ArangoDBGraphMerger:
         
         # Ensure the graph and its collections exist
         if not self.db.has_graph('knowledge_graph'):
-            graph = self.db.create_graph('knowledge_graph')
-            graph.create_vertex_collection('nodes')
-            graph.create_edge_definition(
+            self.graph = self.db.create_graph('knowledge_graph')
+            self.graph.create_vertex_collection('nodes')
+            self.graph.create_edge_definition(
                 edge_collection='edges',
                 from_vertex_collections=['nodes'],
                 to_vertex_collections=['nodes']
@@ -19,36 +20,39 @@ class ArangoDBGraphMerger:
             self.graph = self.db.graph('knowledge_graph')
 
     def merge_data(self, new_data):
-        data = json.loads(new_data)
+        batch = GraphBatch.coerce(new_data)
         
         # Merge nodes
-        for node in data.get('nodes', []):
+        for node in batch.nodes:
             self._merge_node(node)
 
         # Merge edges
-        for edge in data.get('edges', []):
+        for edge in batch.edges:
             self._merge_edge(edge)
 
     def _merge_node(self, node):
         nodes = self.db.collection('nodes')
-        node_key = node.get('id')
+        node_key = node.id
         
         if not node_key:
             print(f"Skipping node due to missing id: {node}")
             return
         
-        if nodes.has(node_key):
-            # Update existing node
-            nodes.update({'_key': node_key, **node})
+        existing = nodes.get(node_key)
+        if existing:
+            # Update existing node; mention counts and scores add up over ingests
+            document = node.to_dict()
+            document['data'] = fold_salience(existing.get('data'), document['data'])
+            nodes.update({'_key': node_key, **document})
         else:
             # Insert new node
-            nodes.insert({'_key': node_key, **node})
+            nodes.insert({'_key': node_key, **node.to_dict()})
 
     def _merge_edge(self, edge):
         edges = self.db.collection('edges')
         
-        source = edge.get('source')
-        target = edge.get('target')
+        source = edge.source
+        target = edge.target
         
         if not source or not target:
             print(f"Skipping edge due to missing source or target: {edge}")
@@ -57,24 +61,109 @@ class ArangoDBGraphMerger:
         edge_key = f"{source}-{target}"
         
         # In ArangoDB, edges need _from and _to fields
-        edge['_from'] = f"nodes/{source}"
-        edge['_to'] = f"nodes/{target}"
+        document = edge.to_dict()
+        document['_from'] = f"nodes/{source}"
+        document['_to'] = f"nodes/{target}"
         
-        if edges.has(edge_key):
+        existing = edges.get(edge_key)
+        if existing:
             # Update existing edge
-            edges.update({'_key': edge_key, **edge})
+            document['data'] = fold_salience(existing.get('data'), document['data'])
+            edges.update({'_key': edge_key, **document})
         else:
             # Insert new edge
-            edges.insert({'_key': edge_key, **edge})
+            edges.insert({'_key': edge_key, **document})
 
-    def search(self, query):
+    def bulk_upsert(self, batch):
+        nodes = [{'_key': node.id, **node.to_dict()} for node in batch.nodes if node.id]
+        edges = [
+            {
+                '_key': f"{edge.source}-{edge.target}",
+                '_from': f"nodes/{edge.source}",
+                '_to': f"nodes/{edge.target}",
+                **edge.to_dict(),
+            }
+            for edge in batch.edges if edge.source and edge.target
+        ]
+        if nodes:
+            self.db.collection('nodes').import_bulk(nodes, on_duplicate='update')
+        if edges:
+            self.db.collection('edges').import_bulk(edges, on_duplicate='update')
+
+    def _iter_collection(self, collection, page_size):
+        # Streaming cursors hand over one batch at a time
+        cursor = self.db.aql.execute(
+            f"FOR doc IN {collection} RETURN doc", batch_size=page_size, stream=True
+        )
+        page = []
+        for doc in cursor:
+            page.append(doc)
+            if len(page) >= page_size:
+                yield page
+                page = []
+        if page:
+            yield page
+
+    def iter_nodes(self, page_size=1000):
+        for page in self._iter_collection('nodes', page_size):
+            yield [Node.from_dict(self._clean(doc)) for doc in page]
+
+    def iter_edges(self, page_size=1000):
+        for page in self._iter_collection('edges', page_size):
+            yield [Edge.from_dict(self._clean(doc)) for doc in page]
+
+    def mark_stale(self, node_ids, edges):
+        if node_ids:
+            self.db.collection('nodes').update_many([{'_key': node_id, 'status': 'stale'} for node_id in node_ids])
+        if edges:
+            self.db.collection('edges').update_many([{'_key': f"{source}-{target}", 'status': 'stale'} for source, target, _ in edges])
+
+    def search(self, query, limit=25):
         aql = """
         FOR doc IN nodes
             FILTER LIKE(TO_STRING(doc), @query, true)
+            LIMIT @limit
             RETURN doc
         """
-        cursor = self.db.aql.execute(aql, bind_vars={'query': f'%{query}%'})
-        return [doc for doc in cursor]
+        cursor = self.db.aql.execute(aql, bind_vars={'query': f'%{query}%', 'limit': limit})
+        return [self._clean(doc) for doc in cursor]
+
+    @staticmethod
+    def _clean(doc):
+        # Drop _key/_id/_rev/_from/_to, the graph fields carry the same information
+        return {key: value for key, value in doc.items() if not key.startswith('_')}
+
+    def neighbourhood(self, node_id, depth=1, limit=200):
+        aql = """
+        FOR v, e IN 1..@depth ANY @start GRAPH 'knowledge_graph'
+            LIMIT @limit
+            RETURN {vertex: v, edge: e}
+        """
+        start = f"nodes/{node_id}"
+        cursor = self.db.aql.execute(aql, bind_vars={'start': start, 'depth': depth, 'limit': limit})
+
+        nodes = {}
+        edges = {}
+        root = self.db.collection('nodes').get(node_id)
+        if root:
+            nodes[node_id] = self._clean(root)
+        for row in cursor:
+            nodes[row['vertex']['_key']] = self._clean(row['vertex'])
+            edges[row['edge']['_key']] = self._clean(row['edge'])
+        return {"nodes": list(nodes.values()), "edges": list(edges.values())}
+
+    def path(self, source, target, max_depth=4):
+        aql = """
+        FOR v, e IN ANY SHORTEST_PATH @source TO @target GRAPH 'knowledge_graph'
+            RETURN {vertex: v, edge: e}
+        """
+        cursor = self.db.aql.execute(aql, bind_vars={'source': f"nodes/{source}", 'target': f"nodes/{target}"})
+
+        rows = list(cursor)
+        edges = [self._clean(row['edge']) for row in rows if row['edge']]
+        if not edges or len(edges) > max_depth:
+            return {"nodes": [], "edges": []}
+        return {"nodes": [self._clean(row['vertex']) for row in rows], "edges": edges}
 
     def visualize(self):
         # This is a placeholder for visualization logic
@@ -0,0 +1,126 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+cache_size = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+cache_ttl = float(os.getenv("QUERY_CACHE_TTL", "300"))
+invalidation_channel = "nuner:cache:invalidate"
+
+# Tag carried by results that any write may change, such as a path query
+# that has not found a path yet
+ANY_WRITE = "*"
+
+
+class QueryCache:
+    def __init__(self, size=cache_size, ttl=cache_ttl):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.tags = {}
+        self.generation = 0
+        self.recent = deque(maxlen=1024)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, node_ids, generation=None):
+        with self.lock:
+            # An invalidation that arrived while the query ran may already
+            # cover this result, so it is not safe to keep
+            if generation is not None and self._invalidated_since(generation, node_ids):
+                return
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (time.monotonic() + self.ttl, value, frozenset(node_ids))
+            for node_id in node_ids:
+                self.tags.setdefault(node_id, set()).add(key)
+            while len(self.entries) > self.size:
+                self._drop(next(iter(self.entries)))
+
+    def _drop(self, key):
+        _, _, node_ids = self.entries.pop(key)
+        for node_id in node_ids:
+            keys = self.tags.get(node_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[node_id]
+
+    def _invalidated_since(self, generation, node_ids):
+        if generation == self.generation:
+            return False
+        if not self.recent or self.recent[0][0] > generation + 1:
+            # Older invalidations were already forgotten, assume the worst
+            return True
+        return any(
+            ANY_WRITE in node_ids or not node_ids.isdisjoint(ids)
+            for invalidated, ids in self.recent if invalidated > generation
+        )
+
+    def invalidate(self, node_ids):
+        with self.lock:
+            self.generation += 1
+            self.recent.append((self.generation, frozenset(node_ids)))
+            keys = set()
+            for node_id in list(node_ids) + [ANY_WRITE]:
+                keys.update(self.tags.get(node_id, ()))
+            for key in keys:
+                self._drop(key)
+            return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            # Nothing is known about what changed, treat it as touching everything
+            self.recent.clear()
+            self.entries.clear()
+            self.tags.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+def publish_invalidation(conn, batch):
+    # Called by the write path; every touched node, including edge endpoints
+    node_ids = batch.node_ids()
+    for edge in batch.edges:
+        node_ids.add(edge.source)
+        node_ids.add(edge.target)
+    conn.publish(invalidation_channel, json.dumps(sorted(node_ids)))
+
+
+def subscribe_invalidations(conn, cache):
+    def listen():
+        while True:
+            try:
+                pubsub = conn.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(invalidation_channel)
+                for message in pubsub.listen():
+                    cache.invalidate(json.loads(message["data"]))
+            except Exception as e:
+                # Messages may have been missed while disconnected
+                logger.error(f"Cache invalidation listener failed, clearing cache: {str(e)}")
+                cache.clear()
+                time.sleep(1)
+
+    thread = threading.Thread(target=listen, name="cache-invalidation", daemon=True)
+    thread.start()
+    return thread
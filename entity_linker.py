@@ -0,0 +1,289 @@
+import fcntl
+import glob
+import json
+import logging
+import os
+import re
+from contextlib import contextmanager
+
+import hnswlib
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+index_dir = os.getenv("ENTITY_INDEX_DIR", "/home/appuser/.cache/nuner/entities")
+embedding_model = os.getenv("ENTITY_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+snapshot_every = int(os.getenv("ENTITY_INDEX_SNAPSHOT_EVERY", "1000"))
+
+
+class EntityIndex:
+    # Canonical entities of a single type. Vectors live in a memory-mapped
+    # .npy matrix and ids/names in an append-only JSONL log; a small state
+    # file says how much of both is committed. Adds only append, and the HNSW
+    # graph is snapshotted every snapshot_every entities, so a worker catches
+    # up by replaying what was committed after its own copy or the snapshot.
+
+    def __init__(self, directory, entity_type, dim, initial_capacity=1024, snapshot_every=snapshot_every):
+        self.directory = directory
+        self.entity_type = entity_type
+        self.dim = dim
+        self.initial_capacity = initial_capacity
+        self.snapshot_every = snapshot_every
+
+        base = os.path.join(directory, re.sub(r'\W+', '_', entity_type.lower()))
+        self.vectors_path = base + ".vectors.npy"
+        self.log_path = base + ".entities.jsonl"
+        self.state_path = base + ".state.json"
+        self.index_path = base + ".hnsw"
+        self.lock_path = base + ".lock"
+
+        self.ids = []
+        self.names = []
+        self.log_size = 0
+        self.snapshot_count = 0
+        self.vectors = None
+        self.index = None
+        self.load()
+
+    def __len__(self):
+        return len(self.ids)
+
+    @contextmanager
+    def locked(self):
+        # One lock per type, workers linking other types are not held up
+        with open(self.lock_path, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield self
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_state(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return 0, 0
+        return state["count"], state["log_size"]
+
+    def _write_state(self):
+        with open(self.state_path + ".tmp", "w") as f:
+            json.dump({"type": self.entity_type, "count": len(self.ids), "log_size": self.log_size}, f)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def load(self):
+        self.ids, self.names, self.log_size = [], [], 0
+        self.vectors = None
+        self.index = None
+
+        count, _ = self._read_state()
+        if count and os.path.exists(self.index_path):
+            index = hnswlib.Index(space="cosine", dim=self.dim)
+            index.load_index(self.index_path, max_elements=np.load(self.vectors_path, mmap_mode="r").shape[0])
+            if index.get_current_count() <= count:
+                self.index = index
+            else:
+                # Snapshots are only taken after a commit, so this one is not
+                # ours to trust; the matrix is the source of truth
+                logger.warning(f"Rebuilding ANN index for type {self.entity_type}: "
+                               f"{index.get_current_count()} elements for {count} entities")
+
+        if self.index is None:
+            self.index = self._new_index(self.initial_capacity)
+        self.snapshot_count = self.index.get_current_count()
+        self.refresh()
+
+    def refresh(self):
+        # Catch up with what other workers committed since this copy was
+        # loaded; only the state file is read when nothing changed
+        count, log_size = self._read_state()
+        if count == len(self.ids):
+            return False
+        if count < len(self.ids):
+            # The files were replaced underneath us, start over
+            self.load()
+            return True
+
+        with open(self.log_path, "rb") as f:
+            f.seek(self.log_size)
+            for line in f.read(log_size - self.log_size).splitlines():
+                record = json.loads(line)
+                self.ids.append(record["id"])
+                self.names.append(record["name"])
+        self.log_size = log_size
+
+        # Another worker may have grown the matrix into a new file
+        self.vectors = np.load(self.vectors_path, mmap_mode="r+")
+        if self.index.get_max_elements() < self.vectors.shape[0]:
+            self.index.resize_index(self.vectors.shape[0])
+        indexed = self.index.get_current_count()
+        if indexed < count:
+            self.index.add_items(self.vectors[indexed:count], np.arange(indexed, count))
+        return True
+
+    def _new_index(self, capacity):
+        index = hnswlib.Index(space="cosine", dim=self.dim)
+        index.init_index(max_elements=capacity, ef_construction=200, M=16)
+        index.set_ef(64)
+        return index
+
+    def _ensure_capacity(self, needed):
+        capacity = 0 if self.vectors is None else self.vectors.shape[0]
+        if needed <= capacity:
+            return
+
+        new_capacity = max(self.initial_capacity, capacity)
+        while new_capacity < needed:
+            new_capacity *= 2
+
+        tmp_path = self.vectors_path + ".tmp"
+        grown = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(new_capacity, self.dim))
+        if self.vectors is not None:
+            grown[:len(self.ids)] = self.vectors[:len(self.ids)]
+        grown.flush()
+        del grown
+        os.replace(tmp_path, self.vectors_path)
+
+        self.vectors = np.load(self.vectors_path, mmap_mode="r+")
+        if self.index.get_max_elements() < new_capacity:
+            self.index.resize_index(new_capacity)
+
+    def add(self, ids, names, vectors):
+        # Callers hold locked() and have refreshed, so nothing is committed
+        # past len(self.ids). Rows and log records beyond the committed state
+        # were left by a writer that died, and are overwritten.
+        start = len(self.ids)
+        end = start + len(ids)
+        self._ensure_capacity(end)
+
+        self.vectors[start:end] = vectors
+        self.vectors.flush()
+        self.index.add_items(vectors, np.arange(start, end))
+
+        records = "".join(json.dumps({"id": id, "name": name}) + "\n" for id, name in zip(ids, names)).encode("utf-8")
+        with open(self.log_path, "ab") as f:
+            f.truncate(self.log_size)
+            f.write(records)
+        self.log_size += len(records)
+        self.ids.extend(ids)
+        self.names.extend(names)
+        # The commit point
+        self._write_state()
+
+        if len(self.ids) - self.snapshot_count >= self.snapshot_every:
+            self.snapshot()
+
+    def snapshot(self):
+        self.index.save_index(self.index_path + ".tmp")
+        os.replace(self.index_path + ".tmp", self.index_path)
+        self.snapshot_count = self.index.get_current_count()
+
+    def query(self, vectors, k=1):
+        if not self.ids:
+            return None, None
+        labels, distances = self.index.knn_query(vectors, k=min(k, len(self.ids)))
+        # hnswlib reports cosine distance, callers think in similarity
+        return labels, 1.0 - distances
+
+
+class EntityLinker:
+    def __init__(self, directory=index_dir, model_name=embedding_model, threshold=0.85, batch_size=64):
+        from sentence_transformers import SentenceTransformer
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.threshold = threshold
+        self.batch_size = batch_size
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.indexes = {}
+
+    def _index(self, entity_type):
+        if entity_type not in self.indexes:
+            self.indexes[entity_type] = EntityIndex(self.directory, entity_type, self.dim)
+        return self.indexes[entity_type]
+
+    def load_indexes(self):
+        # rq runs every job in a fresh fork, so indexes loaded here in the
+        # parent are inherited and a job only replays the entities added
+        # since, instead of reading every type from disk again
+        for path in glob.glob(os.path.join(self.directory, "*.state.json")):
+            with open(path) as f:
+                self._index(json.load(f)["type"])
+        return len(self.indexes)
+
+    def embed(self, texts):
+        return self.model.encode(
+            texts, batch_size=self.batch_size, convert_to_numpy=True, normalize_embeddings=True
+        ).astype(np.float32)
+
+    def link(self, batch):
+        nodes = batch.nodes
+        if not nodes:
+            return batch
+
+        # Embedding is the expensive part, do it once for the whole job and
+        # before taking any lock so other workers are not held up by it
+        vectors = self.embed([node.label for node in nodes])
+
+        by_type = {}
+        for i, node in enumerate(nodes):
+            by_type.setdefault(node.type, []).append(i)
+
+        id_map = {}
+        for entity_type, positions in by_type.items():
+            with self._index(entity_type).locked() as index:
+                index.refresh()
+                self._link_type(index, [nodes[i] for i in positions], vectors[positions], id_map)
+
+        for edge in batch.edges:
+            edge.source = id_map.get(edge.source, edge.source)
+            edge.target = id_map.get(edge.target, edge.target)
+            edge.id = f"{edge.source}-{edge.target}"
+
+        return batch
+
+    def _link_type(self, index, nodes, vectors, id_map):
+        labels, similarities = index.query(vectors)
+
+        new_ids, new_names, new_vectors = [], [], []
+        for i, node in enumerate(nodes):
+            canonical_id = canonical_name = None
+            similarity = 0.0
+
+            # A failed add can leave the ANN index ahead of the committed ids
+            position = int(labels[i][0]) if labels is not None else len(index.ids)
+            if position < len(index.ids) and similarities[i][0] >= self.threshold:
+                canonical_id, canonical_name = index.ids[position], index.names[position]
+                similarity = float(similarities[i][0])
+            elif new_vectors:
+                # Mentions that are new to the index may still match each other
+                pending = np.dot(np.stack(new_vectors), vectors[i])
+                best = int(np.argmax(pending))
+                if pending[best] >= self.threshold:
+                    canonical_id, canonical_name = new_ids[best], new_names[best]
+                    similarity = float(pending[best])
+
+            if canonical_id is None:
+                canonical_id, canonical_name, similarity = node.id, node.label, 1.0
+                new_ids.append(canonical_id)
+                new_names.append(canonical_name)
+                new_vectors.append(vectors[i])
+
+            id_map[node.id] = canonical_id
+            node.id = canonical_id
+            node.label = canonical_name
+            node.data["link_score"] = similarity
+
+        if new_ids:
+            index.add(new_ids, new_names, np.stack(new_vectors))
+
+
+_linker = None
+
+
+def get_linker():
+    global _linker
+    if _linker is None:
+        _linker = EntityLinker()
+    return _linker
@@ -1,9 +1,20 @@
 import json
 import logging
+import os
 
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
 
+from cache import publish_invalidation
+from entity_linker import get_linker
+from graph_batch import Edge, GraphBatch, Node
+from graph_stats import GraphStats
+from manifest import ChunkManifest, Provenance, chunk_hash
+from mentions import aggregate_mentions
+from mergers import get_merger
+from predictions import merge_predictions, parse_prediction, split_windows
+from worker import conn
+
 logger = logging.getLogger(__name__)
 
 model = AutoModelForCausalLM.from_pretrained(
@@ -11,58 +22,104 @@ model = AutoModelForCausalLM.from_pretrained(
 )
 
 tokenizer = AutoTokenizer.from_pretrained("numind/NuExtract", trust_remote_code=True)
+# Batched generation needs left padding so every prompt ends right before its output
+tokenizer.padding_side = "left"
+if tokenizer.pad_token is None:
+    tokenizer.pad_token = tokenizer.eos_token
 
 model.eval()
 
+max_length = 4000
+max_new_tokens = int(os.getenv("NUEXTRACT_MAX_NEW_TOKENS", "1000"))
+window_overlap = int(os.getenv("NUEXTRACT_WINDOW_OVERLAP", "200"))
+window_batch_size = int(os.getenv("NUEXTRACT_BATCH_SIZE", "4"))
+
+schema = """{
+    "nodes": [{
+        "id": "",
+        "name": "",
+        "type": "",
+        "status": "",
+        "description": "",
+        "history": [{
+            "timestamp": "",
+            "status": "",
+            "description": ""
+        }],
+        "tags": [],
+        "urls": []
+    }],
+    "edges": [{
+        "id": "",
+        "source": "",
+        "target": "",
+        "label": "",
+        "status": ""
+    }]
+}"""
+
 
 class Job:
     def __init__(self, profile):
         self.profile = profile
 
-    def predict_NuExtract(self, model, tokenizer, text, schema, example=["", "", ""]):
+    @staticmethod
+    def build_prompt(schema, example=["", "", ""]):
         schema = json.dumps(json.loads(schema), indent=4)
-        input_llm = "<|input|>\n### Template:\n" + schema + "\n"
+        prefix = "<|input|>\n### Template:\n" + schema + "\n"
         for i in example:
             if i != "":
-                input_llm += (
+                prefix += (
                     "### Example:\n" + json.dumps(json.loads(i), indent=4) + "\n"
                 )
 
-        input_llm += "### Text:\n" + text + "\n<|output|>\n"
+        return prefix + "### Text:\n", "\n<|output|>\n"
+
+    def predict_NuExtract(self, model, tokenizer, text, schema, example=["", "", ""]):
+        prefix, suffix = self.build_prompt(schema, example)
+        return self.predict_batch(model, tokenizer, [prefix + text + suffix])[0]
+
+    @staticmethod
+    def predict_batch(model, tokenizer, prompts):
         input_ids = tokenizer(
-            input_llm, return_tensors="pt", truncation=True, max_length=4000
-        ).to("cuda")
+            prompts, return_tensors="pt", padding=True, truncation=True, max_length=max_length
+        ).to(model.device)
 
-        output = tokenizer.decode(
-            model.generate(**input_ids)[0], skip_special_tokens=True
-        )
-        return output.split("<|output|>")[1].split("<|end-output|>")[0]
+        with torch.no_grad():
+            generated = model.generate(**input_ids, max_new_tokens=max_new_tokens)
 
-    def do(self):
-        schema = """{
-            "nodes": [{
-                "id": "",
-                "name": "",
-                "type": "",
-                "status": "",
-                "description": "",
-                "history": [{
-                    "timestamp": "",
-                    "status": "",
-                    "description": ""
-                }],
-                "tags": [],
-                "urls": []
-            }],
-            "edges": [{
-                "id": "",
-                "source": "",
-                "target": "",
-                "label": "",
-                "status": ""
-            }]
-        }"""
+        outputs = []
+        for sequence in tokenizer.batch_decode(generated, skip_special_tokens=True):
+            outputs.append(sequence.split("<|output|>")[-1].split("<|end-output|>")[0])
+        return outputs
+
+    def extract(self, chunks):
+        prefix, suffix = self.build_prompt(schema)
+        prompt_tokens = len(tokenizer(prefix + suffix)["input_ids"])
+        window_tokens = max_length - prompt_tokens - max_new_tokens
+        if window_tokens <= 0:
+            raise ValueError(
+                f"No room for text: the prompt takes {prompt_tokens} and the output {max_new_tokens} "
+                f"of {max_length} tokens, lower NUEXTRACT_MAX_NEW_TOKENS"
+            )
+
+        windows = []
+        for index, chunk in enumerate(chunks):
+            for window in split_windows(tokenizer, chunk, window_tokens, window_overlap):
+                windows.append((index, window))
+
+        # Predictions stay grouped by chunk so callers can tell which chunk
+        # produced which elements
+        predictions = [[] for _ in chunks]
+        for start in range(0, len(windows), window_batch_size):
+            group = windows[start:start + window_batch_size]
+            outputs = self.predict_batch(model, tokenizer, [prefix + window + suffix for _, window in group])
+            for (index, _), output in zip(group, outputs):
+                predictions[index].append(parse_prediction(output))
+
+        return predictions
 
+    def do(self):
         page = self.profile.get("page")
         if not page:
             logger.error("Invalid profile data: missing page.")
@@ -78,8 +135,73 @@ class Job:
             logger.error("Invalid profile data: missing chunks.")
             return
 
-        for chunk in chunks:
-            prediction = self.predict_NuExtract(
-                model, tokenizer, chunk, schema, example=["", "", ""]
-            )
-            print(prediction)
+        url = (page.get("info") or {}).get("url")
+        source = f"nuextract:{url or 'anonymous'}"
+        manifest = ChunkManifest(conn, url) if url else None
+        previous = manifest.load() if manifest else {}
+
+        hashes = [chunk_hash(chunk) for chunk in chunks]
+        changed, removed = ChunkManifest.diff(previous, hashes)
+        if not changed and not removed:
+            logger.info(f"No changed chunks for {url}, skipping")
+            return
+        logger.info(f"Extracting {len(changed)} of {len(chunks)} chunks, {len(removed)} removed")
+
+        predictions = self.extract([chunks[position] for position in changed])
+        batch = merge_predictions([prediction for chunk in predictions for prediction in chunk])
+        logger.info(f"Extracted {len(batch.nodes)} nodes and {len(batch.edges)} edges")
+
+        # Resolve mentions to canonical entities, then fold the ones that
+        # linked to the same entity, as the GLiNER job does
+        mention_ids = [node.id for node in batch.nodes]
+        get_linker().link(batch)
+        linked = {mention: node.id for mention, node in zip(mention_ids, batch.nodes)}
+        folded = {}
+        batch = aggregate_mentions(batch, folded)
+
+        def resolve(node_id):
+            node_id = linked.get(node_id, node_id)
+            return folded.get(node_id, node_id)
+
+        # The manifest has to name the elements as they were written
+        entries = {hash: previous[hash] for hash in hashes if hash in previous}
+        # A window whose output could not be parsed at all lost its elements;
+        # its chunk is left out of the saved manifest so the next visit retries it
+        unparsed = set()
+        for position, chunk_predictions in zip(changed, predictions):
+            if any(not prediction for prediction in chunk_predictions):
+                unparsed.add(hashes[position])
+            chunk_batch = merge_predictions(chunk_predictions)
+            for node in chunk_batch.nodes:
+                node.id = resolve(node.id)
+            for edge in chunk_batch.edges:
+                edge.source, edge.target = resolve(edge.source), resolve(edge.target)
+            entries[hashes[position]] = ChunkManifest.entry(hashes[position], chunk_batch)
+        entries = [entries[hash] for hash in dict.fromkeys(hashes)]
+
+        try:
+            merger = get_merger()
+            merger.merge_data(batch)
+            provenance = Provenance(conn)
+            provenance.add(source, batch)
+            publish_invalidation(conn, batch)
+            GraphStats(conn).record(batch)
+
+            # What this page no longer produces may still come from another one
+            stale_nodes, stale_edges = provenance.release(source, *ChunkManifest.stale_elements(removed, entries))
+            if stale_nodes or stale_edges:
+                logger.info(f"Marking {len(stale_nodes)} nodes and {len(stale_edges)} edges stale for {url}")
+                merger.mark_stale(stale_nodes, stale_edges)
+                publish_invalidation(conn, GraphBatch(
+                    [Node(node_id, None, None) for node_id in stale_nodes],
+                    [Edge(source, target, label) for source, target, label in stale_edges],
+                ))
+        except Exception as e:
+            logger.error(f"Error merging data: {str(e)}")
+            return
+
+        # Only remember the chunks once their elements are in the graph
+        if manifest:
+            if unparsed:
+                logger.warning(f"{len(unparsed)} chunks of {url} had unparseable output, extracting them again next time")
+            manifest.save([entry for entry in entries if entry["hash"] not in unparsed])
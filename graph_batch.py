@@ -0,0 +1,142 @@
+import json
+
+SCALAR_TYPES = (str, int, float, bool)
+
+
+def _property_value(value):
+    # Graph stores take scalars and flat lists of one scalar type natively
+    # (Neo4j rejects mixed lists, and bool is not an int there), only
+    # anything else still has to be encoded
+    if value is None or isinstance(value, SCALAR_TYPES):
+        return value
+    if isinstance(value, (list, tuple)) and all(isinstance(item, SCALAR_TYPES) for item in value) \
+            and len({type(item) for item in value}) <= 1:
+        return list(value)
+    return json.dumps(value)
+
+
+class Node:
+    __slots__ = ("id", "type", "label", "status", "data")
+
+    def __init__(self, id, type, label, status="active", data=None):
+        self.id = id
+        self.type = type
+        self.label = label
+        self.status = status
+        self.data = data if data is not None else {}
+
+    def properties(self):
+        properties = {"id": self.id, "status": self.status, "type": self.type, "label": self.label}
+        for key, value in self.data.items():
+            properties[key] = _property_value(value)
+        return properties
+
+    def to_dict(self):
+        return {"id": self.id, "status": self.status, "type": self.type, "label": self.label, "data": self.data}
+
+    @classmethod
+    def from_dict(cls, node):
+        return cls(node.get("id"), node.get("type", "Entity"), node.get("label", ""), node.get("status", "active"), node.get("data"))
+
+    @classmethod
+    def from_properties(cls, properties):
+        # Inverse of properties(), for reading nodes back out of a store
+        data = {key: value for key, value in properties.items() if key not in ("id", "type", "label", "status")}
+        return cls(properties.get("id"), properties.get("type", "Entity"), properties.get("label", ""), properties.get("status", "active"), data)
+
+    def __repr__(self):
+        return f"Node({self.id!r}, {self.type!r}, {self.label!r})"
+
+
+class Edge:
+    __slots__ = ("id", "source", "target", "label", "type", "status", "data")
+
+    def __init__(self, source, target, label, id=None, type="directed", status="active", data=None):
+        self.id = id or f"{source}-{target}"
+        self.source = source
+        self.target = target
+        self.label = label
+        self.type = type
+        self.status = status
+        self.data = data if data is not None else {}
+
+    def properties(self):
+        # source and target are structural, not stored on the relationship. The
+        # label is kept as well because some stores mangle it into a type name.
+        properties = {"id": self.id, "status": self.status, "type": self.type, "label": self.label}
+        for key, value in self.data.items():
+            properties[key] = _property_value(value)
+        return properties
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "source": self.source,
+            "target": self.target,
+            "status": self.status,
+            "type": self.type,
+            "label": self.label,
+            "data": self.data,
+        }
+
+    @classmethod
+    def from_dict(cls, edge):
+        return cls(
+            edge.get("source"), edge.get("target"), edge.get("label", "RELATED_TO"),
+            edge.get("id"), edge.get("type", "directed"), edge.get("status", "active"), edge.get("data"),
+        )
+
+    @classmethod
+    def from_properties(cls, source, target, label, properties):
+        data = {key: value for key, value in properties.items() if key not in ("id", "type", "label", "status", "source", "target")}
+        return cls(
+            source, target, properties.get("label") or label,
+            properties.get("id"), properties.get("type", "directed"), properties.get("status", "active"), data,
+        )
+
+    def __repr__(self):
+        return f"Edge({self.source!r} -[{self.label!r}]-> {self.target!r})"
+
+
+class GraphBatch:
+    __slots__ = ("nodes", "edges")
+
+    def __init__(self, nodes=None, edges=None):
+        self.nodes = nodes if nodes is not None else []
+        self.edges = edges if edges is not None else []
+
+    def __len__(self):
+        return len(self.nodes) + len(self.edges)
+
+    def extend(self, other):
+        self.nodes.extend(other.nodes)
+        self.edges.extend(other.edges)
+
+    def node_ids(self):
+        return {node.id for node in self.nodes}
+
+    def to_dict(self):
+        return {"nodes": [node.to_dict() for node in self.nodes], "edges": [edge.to_dict() for edge in self.edges]}
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            [Node.from_dict(node) for node in data.get("nodes", [])],
+            [Edge.from_dict(edge) for edge in data.get("edges", [])],
+        )
+
+    @classmethod
+    def from_json(cls, data):
+        return cls.from_dict(json.loads(data))
+
+    @classmethod
+    def coerce(cls, data):
+        # JSON is only expected where a batch crossed a process boundary
+        if isinstance(data, cls):
+            return data
+        if isinstance(data, (str, bytes)):
+            return cls.from_json(data)
+        return cls.from_dict(data)
@@ -0,0 +1,216 @@
+import argparse
+import gzip
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from cache import publish_invalidation
+from graph_batch import Edge, GraphBatch, Node
+from graph_stats import GraphStats
+from manifest import Provenance
+from mergers import create_merger, graph_backend
+
+logger = logging.getLogger(__name__)
+
+records_per_part = int(os.getenv("EXPORT_RECORDS_PER_PART", "100000"))
+page_size = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+# Parts are spooled to disk past this size, so memory stays bounded whatever the part size
+spool_size = 16 * 1024 * 1024
+
+
+class LocalStore:
+    # Stand-in for the object store, same interface over a directory
+
+    def __init__(self, root):
+        self.root = root
+
+    def put(self, name, fileobj, length):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            shutil.copyfileobj(fileobj, f)
+        os.replace(path + ".tmp", path)
+
+    def open(self, name):
+        return open(os.path.join(self.root, name), "rb")
+
+
+class MinioStore:
+    def __init__(self, endpoint, access_key, secret_key, bucket, secure=False):
+        from minio import Minio
+
+        self.client = Minio(endpoint, access_key=access_key, secret_key=secret_key, secure=secure)
+        self.bucket = bucket
+        if not self.client.bucket_exists(bucket):
+            self.client.make_bucket(bucket)
+
+    def put(self, name, fileobj, length):
+        self.client.put_object(self.bucket, name, fileobj, length)
+
+    def open(self, name):
+        # The response streams from the server, gzip reads it incrementally
+        return self.client.get_object(self.bucket, name)
+
+
+def create_store(target):
+    if target.startswith("minio://"):
+        return MinioStore(
+            os.getenv("MINIO_ENDPOINT", "minio:9000"),
+            os.getenv("MINIO_ACCESS_KEY", "minioadmin"),
+            os.getenv("MINIO_SECRET_KEY", "minioadmin"),
+            target[len("minio://"):],
+            os.getenv("MINIO_SECURE", "false").lower() == "true",
+        )
+    return LocalStore(target)
+
+
+class GraphExporter:
+    def __init__(self, merger, store, snapshot):
+        self.merger = merger
+        self.store = store
+        self.snapshot = snapshot
+
+    def _write_parts(self, kind, pages):
+        parts = []
+        count = 0
+        spool = gzip_file = None
+        part_records = 0
+
+        def flush():
+            gzip_file.close()
+            length = spool.tell()
+            spool.seek(0)
+            name = f"{self.snapshot}/{kind}-{len(parts):05d}.jsonl.gz"
+            self.store.put(name, spool, length)
+            spool.close()
+            parts.append({"name": name, "records": part_records})
+            logger.info(f"Wrote {name} ({part_records} records, {length} bytes)")
+
+        for page in pages:
+            for record in page:
+                if gzip_file is None:
+                    spool = tempfile.SpooledTemporaryFile(max_size=spool_size)
+                    gzip_file = gzip.GzipFile(fileobj=spool, mode="wb")
+                    part_records = 0
+                gzip_file.write(json.dumps(record.to_dict()).encode("utf-8") + b"\n")
+                part_records += 1
+                count += 1
+                if part_records >= records_per_part:
+                    flush()
+                    gzip_file = None
+
+        if gzip_file is not None:
+            flush()
+        return parts, count
+
+    def export(self):
+        started = time.time()
+        # Nodes first, so a loader can create every endpoint before its edges
+        node_parts, node_count = self._write_parts("nodes", self.merger.iter_nodes(page_size))
+        edge_parts, edge_count = self._write_parts("edges", self.merger.iter_edges(page_size))
+
+        manifest = {
+            "snapshot": self.snapshot,
+            "backend": type(self.merger).__name__,
+            "created_at": started,
+            "format": "jsonl.gz",
+            "nodes": {"records": node_count, "parts": node_parts},
+            "edges": {"records": edge_count, "parts": edge_parts},
+        }
+        data = json.dumps(manifest, indent=2).encode("utf-8")
+        self.store.put(f"{self.snapshot}/manifest.json", io.BytesIO(data), len(data))
+        logger.info(f"Exported {node_count} nodes and {edge_count} edges to snapshot {self.snapshot}")
+        return manifest
+
+
+class GraphLoader:
+    def __init__(self, merger, store, snapshot, conn=None):
+        self.merger = merger
+        self.store = store
+        self.snapshot = snapshot
+        # Redis of the running deployment, when there is one to keep in step
+        self.conn = conn
+
+    @staticmethod
+    def _close(stream):
+        stream.close()
+        # minio responses also hold a pooled connection
+        if hasattr(stream, "release_conn"):
+            stream.release_conn()
+
+    def _read_records(self, name):
+        stream = self.store.open(name)
+        try:
+            with gzip.GzipFile(fileobj=stream, mode="rb") as f:
+                for line in f:
+                    yield json.loads(line)
+        finally:
+            self._close(stream)
+
+    def manifest(self):
+        stream = self.store.open(f"{self.snapshot}/manifest.json")
+        try:
+            return json.loads(stream.read())
+        finally:
+            self._close(stream)
+
+    def _write(self, batch):
+        self.merger.bulk_upsert(batch)
+        if self.conn is None:
+            return
+        # A load is a write like any other: the statistics count it, the
+        # snapshot becomes a source of its elements and cached reads drop
+        GraphStats(self.conn).record(batch)
+        Provenance(self.conn).add(f"snapshot:{self.snapshot}", batch)
+        publish_invalidation(self.conn, batch)
+
+    def load(self):
+        manifest = self.manifest()
+        loaded = {"nodes": 0, "edges": 0}
+
+        for kind, decode in (("nodes", Node.from_dict), ("edges", Edge.from_dict)):
+            for part in manifest[kind]["parts"]:
+                batch = GraphBatch()
+                records = getattr(batch, kind)
+                for record in self._read_records(part["name"]):
+                    records.append(decode(record))
+                    if len(records) >= page_size:
+                        self._write(batch)
+                        loaded[kind] += len(records)
+                        records.clear()
+                if records:
+                    self._write(batch)
+                    loaded[kind] += len(records)
+                logger.info(f"Loaded {part['name']}")
+
+        logger.info(f"Loaded {loaded['nodes']} nodes and {loaded['edges']} edges from snapshot {self.snapshot}")
+        return loaded
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Export the knowledge graph to, or load it from, a snapshot")
+    parser.add_argument("command", choices=["export", "load"])
+    parser.add_argument("--store", default=os.getenv("EXPORT_STORE", "minio://nuner-snapshots"),
+                        help="minio://<bucket> or a local directory")
+    parser.add_argument("--snapshot", help="snapshot name, defaults to the current time for export")
+    parser.add_argument("--backend", default=graph_backend, help="graph backend to export from or load into")
+    args = parser.parse_args()
+
+    if args.command == "load" and not args.snapshot:
+        parser.error("load needs --snapshot")
+    snapshot = args.snapshot or time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+
+    merger = create_merger(args.backend)
+    store = create_store(args.store)
+    if args.command == "export":
+        GraphExporter(merger, store, snapshot).export()
+    else:
+        from worker import conn
+
+        GraphLoader(merger, store, snapshot, conn).load()
@@ -0,0 +1,170 @@
+import argparse
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+prefix = "nuner:stats"
+ingest_retention = 2 * 60 * 60
+rebuild_page_size = 1000
+
+
+class GraphStats:
+    # Counters kept next to the queue in Redis and updated by the write path,
+    # so dashboards never have to count the graph itself. Membership sets make
+    # re-upserts of existing elements free of double counting.
+
+    def __init__(self, conn, key_prefix=prefix):
+        self.conn = conn
+        self.node_ids = f"{key_prefix}:node_ids"
+        self.edge_ids = f"{key_prefix}:edge_ids"
+        self.labels = f"{key_prefix}:labels"
+        self.relationships = f"{key_prefix}:relationships"
+        self.degree = f"{key_prefix}:degree"
+        self.meta = f"{prefix}:meta"
+
+    def _keys(self):
+        return [self.node_ids, self.edge_ids, self.labels, self.relationships, self.degree]
+
+    @staticmethod
+    def _edge_key(edge):
+        return f"{edge.source}\x1f{edge.label}\x1f{edge.target}"
+
+    def _ingest_key(self, minute):
+        return f"{prefix}:ingest:{minute}"
+
+    def _count(self, nodes, edges):
+        # Returns a pipeline with the counter updates for the elements that
+        # were new to the membership sets, left for the caller to execute
+        nodes = [node for node in nodes if node.id]
+        edges = [edge for edge in edges if edge.source and edge.target]
+
+        pipe = self.conn.pipeline(transaction=False)
+        for node in nodes:
+            pipe.sadd(self.node_ids, node.id)
+        for edge in edges:
+            pipe.sadd(self.edge_ids, self._edge_key(edge))
+        added = pipe.execute()
+
+        pipe = self.conn.pipeline(transaction=False)
+        for node, is_new in zip(nodes, added[:len(nodes)]):
+            if is_new:
+                pipe.hincrby(self.labels, node.type or "Entity", 1)
+        for edge, is_new in zip(edges, added[len(nodes):]):
+            if is_new:
+                pipe.hincrby(self.relationships, edge.label or "RELATED_TO", 1)
+                pipe.zincrby(self.degree, 1, edge.source)
+                pipe.zincrby(self.degree, 1, edge.target)
+        return pipe
+
+    def record(self, batch):
+        pipe = self._count(batch.nodes, batch.edges)
+
+        ingest = self._ingest_key(int(time.time() // 60))
+        pipe.hincrby(ingest, "batches", 1)
+        pipe.hincrby(ingest, "nodes", sum(1 for node in batch.nodes if node.id))
+        pipe.hincrby(ingest, "edges", sum(1 for edge in batch.edges if edge.source and edge.target))
+        pipe.expire(ingest, ingest_retention)
+        pipe.execute()
+
+    def _ingest_rates(self, minutes):
+        now = int(time.time() // 60)
+        pipe = self.conn.pipeline(transaction=False)
+        for minute in range(now - max(minutes) + 1, now + 1):
+            pipe.hgetall(self._ingest_key(minute))
+        buckets = pipe.execute()[::-1]
+
+        rates = {}
+        for window in minutes:
+            totals = {"batches": 0, "nodes": 0, "edges": 0}
+            for bucket in buckets[:window]:
+                for key, value in bucket.items():
+                    totals[key.decode()] += int(value)
+            rates[f"{window}m"] = {key: value / window for key, value in totals.items()}
+        return rates
+
+    def snapshot(self, top=10):
+        pipe = self.conn.pipeline(transaction=False)
+        pipe.hgetall(self.labels)
+        pipe.hgetall(self.relationships)
+        pipe.zrevrange(self.degree, 0, top - 1, withscores=True)
+        pipe.hgetall(self.meta)
+        labels, relationships, degree, meta = pipe.execute()
+
+        labels = {key.decode(): int(value) for key, value in labels.items()}
+        relationships = {key.decode(): int(value) for key, value in relationships.items()}
+        return {
+            "nodes": sum(labels.values()),
+            "edges": sum(relationships.values()),
+            "labels": labels,
+            "relationships": relationships,
+            "top_degree": [{"id": node_id.decode(), "degree": int(score)} for node_id, score in degree],
+            # Per-minute averages over the last 1, 5 and 60 minutes
+            "ingest_per_minute": self._ingest_rates([1, 5, 60]),
+            "last_reconciled": float(meta[b"last_reconciled"]) if b"last_reconciled" in meta else None,
+        }
+
+    def _totals(self):
+        pipe = self.conn.pipeline(transaction=False)
+        pipe.hvals(self.labels)
+        pipe.hvals(self.relationships)
+        return [sum(int(value) for value in values) for values in pipe.execute()]
+
+    def reconcile(self, merger):
+        # The incremental counters drift when elements are removed or edited
+        # outside the write path, so periodically rebuild them from the
+        # backend, membership sets included so later writes are counted
+        # against what the graph really holds. Writes recorded while the
+        # rebuild runs may be missed until the next one.
+        rebuild = GraphStats(self.conn, f"{prefix}:rebuild")
+        self.conn.delete(*rebuild._keys())
+        for page in merger.iter_nodes(rebuild_page_size):
+            rebuild._count(page, []).execute()
+        for page in merger.iter_edges(rebuild_page_size):
+            rebuild._count([], page).execute()
+
+        node_count, edge_count = rebuild._totals()
+        node_total, edge_total = self._totals()
+
+        # An empty graph leaves some rebuild keys unset, and RENAME needs a source
+        pipe = self.conn.pipeline(transaction=False)
+        for key in rebuild._keys():
+            pipe.exists(key)
+        exists = pipe.execute()
+
+        pipe = self.conn.pipeline(transaction=True)
+        for source, destination, present in zip(rebuild._keys(), self._keys(), exists):
+            if present:
+                pipe.rename(source, destination)
+            else:
+                pipe.delete(destination)
+        pipe.hset(self.meta, "last_reconciled", time.time())
+        pipe.execute()
+
+        node_drift = node_count - node_total
+        edge_drift = edge_count - edge_total
+        logger.info(f"Reconciled graph statistics: node drift {node_drift}, edge drift {edge_drift}")
+        return {"node_drift": node_drift, "edge_drift": edge_drift}
+
+
+def reconcile():
+    # Entry point for rq and the periodic loop below
+    from mergers import get_merger
+    from worker import conn
+
+    return GraphStats(conn).reconcile(get_merger())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Periodically rebuild graph statistics from the backend")
+    parser.add_argument("--every", type=int, default=3600, help="seconds between reconciliations")
+    args = parser.parse_args()
+
+    while True:
+        try:
+            reconcile()
+        except Exception as e:
+            logger.error(f"Error reconciling graph statistics: {str(e)}")
+        time.sleep(args.every)
@@ -1,125 +1,210 @@
+from gremlin_python.driver.client import Client
 from gremlin_python.driver.driver_remote_connection import DriverRemoteConnection
 from gremlin_python.structure.graph import Graph
 from gremlin_python.process.graph_traversal import __
 from gremlin_python.process.strategies import *
-from gremlin_python.process.traversal import T, Cardinality
-import json
+from gremlin_python.process.traversal import T, Cardinality, P, TextP
+from graph_batch import Edge, GraphBatch, Node
+from mentions import fold_salience
 import logging
 
 logger = logging.getLogger(__name__)
 
 class JanusGraphMerger:
     def __init__(self, host="janusgraph", port=8182):
+        self.url = f'ws://{host}:{port}/gremlin'
         self.graph = Graph()
-        self.g = self.graph.traversal().withRemote(DriverRemoteConnection(f'ws://{host}:{port}/gremlin', 'g'))
+        self.g = self.graph.traversal().withRemote(DriverRemoteConnection(self.url, 'g'))
 
     def merge_data(self, new_data):
-        data = json.loads(new_data)
+        batch = GraphBatch.coerce(new_data)
         
         # Merge nodes
-        for node in data.get('nodes', []):
+        for node in batch.nodes:
             self._merge_node(node)
 
         # Merge edges
-        for edge in data.get('edges', []):
+        for edge in batch.edges:
             self._merge_edge(edge)
 
-    def _merge_node(self, node):
-        node_id = node.get('id')
+    def _merge_node(self, node, accumulate=True):
+        node_id = node.id
         if not node_id:
             logger.warning(f"Skipping node due to missing id: {node}")
             return
         
+        properties = node.properties()
         vertex = self.g.V().has('id', node_id).toList()
         if vertex:
             # Update existing vertex
             vertex = vertex[0]
-            for key, value in node.items():
-                if key != 'id':
-                    if isinstance(value, dict):
-                        for sub_key, sub_value in value.items():
-                            self.g.V(vertex).property(Cardinality.single, f"{key}_{sub_key}", sub_value).next()
-                    elif isinstance(value, list):
-                        for item in value:
-                            if isinstance(item, dict):
-                                for sub_key, sub_value in item.items():
-                                    self.g.V(vertex).property(Cardinality.list_, f"{key}_{sub_key}", sub_value).next()
-                            else:
-                                self.g.V(vertex).property(Cardinality.set_, key, item).next()
-                    else:
-                        self.g.V(vertex).property(Cardinality.single, key, value).next()
+            if accumulate:
+                existing = self.g.V(vertex).valueMap().next()
+                properties = fold_salience(
+                    {key: value[0] if len(value) == 1 else value for key, value in existing.items()}, properties
+                )
         else:
             # Create new vertex
             vertex = self.g.addV('node').property('id', node_id).next()
-            for key, value in node.items():
-                if key != 'id':
-                    if isinstance(value, dict):
-                        for sub_key, sub_value in value.items():
-                            self.g.V(vertex).property(Cardinality.single, f"{key}_{sub_key}", sub_value).next()
-                    elif isinstance(value, list):
-                        for item in value:
-                            if isinstance(item, dict):
-                                for sub_key, sub_value in item.items():
-                                    self.g.V(vertex).property(Cardinality.list_, f"{key}_{sub_key}", sub_value).next()
-                            else:
-                                self.g.V(vertex).property(Cardinality.set_, key, item).next()
-                    else:
-                        self.g.V(vertex).property(Cardinality.single, key, value).next()
-
-    def _merge_edge(self, edge):
-        source = edge.get('source')
-        target = edge.get('target')
-        label = edge.get('label', 'edge')
+
+        for key, value in properties.items():
+            if key == 'id' or value is None:
+                continue
+            if isinstance(value, list):
+                # Lists are replaced like any other value, set cardinality
+                # would otherwise keep every item ever written
+                self.g.V(vertex).properties(key).drop().iterate()
+                for item in value:
+                    self.g.V(vertex).property(Cardinality.set_, key, item).next()
+            else:
+                self.g.V(vertex).property(Cardinality.single, key, value).next()
+
+    def _merge_edge(self, edge, accumulate=True):
+        source = edge.source
+        target = edge.target
+        label = edge.label or 'edge'
         
         if not source or not target:
             logger.warning(f"Skipping edge due to missing source or target: {edge}")
             return
         
-        edge_id = f"{source}-{target}"
-        
         source_vertex = self.g.V().has('id', source).next()
         target_vertex = self.g.V().has('id', target).next()
         
         existing_edge = self.g.V(source_vertex).outE(label).where(__.inV().is_(target_vertex)).toList()
         
+        properties = edge.properties()
         if existing_edge:
             # Update existing edge
             existing_edge = existing_edge[0]
-            for key, value in edge.items():
-                if key not in ['source', 'target', 'label']:
-                    if isinstance(value, dict):
-                        for sub_key, sub_value in value.items():
-                            self.g.E(existing_edge).property(f"{key}_{sub_key}", sub_value).next()
-                    elif isinstance(value, list):
-                        for item in value:
-                            if isinstance(item, dict):
-                                for sub_key, sub_value in item.items():
-                                    self.g.E(existing_edge).property(f"{key}_{sub_key}", sub_value).next()
-                            else:
-                                self.g.E(existing_edge).property(key, item).next()
-                    else:
-                        self.g.E(existing_edge).property(key, value).next()
+            if accumulate:
+                properties = fold_salience(self.g.E(existing_edge).valueMap().next(), properties)
         else:
             # Create new edge
-            new_edge = self.g.V(source_vertex).addE(label).to(target_vertex).next()
-            for key, value in edge.items():
-                if key not in ['source', 'target', 'label']:
-                    if isinstance(value, dict):
-                        for sub_key, sub_value in value.items():
-                            self.g.E(new_edge).property(f"{key}_{sub_key}", sub_value).next()
-                    elif isinstance(value, list):
-                        for item in value:
-                            if isinstance(item, dict):
-                                for sub_key, sub_value in item.items():
-                                    self.g.E(new_edge).property(f"{key}_{sub_key}", sub_value).next()
-                            else:
-                                self.g.E(new_edge).property(key, item).next()
-                    else:
-                        self.g.E(new_edge).property(key, value).next()
-
-    def search(self, query):
-        results = self.g.V().has('id', __.text().containing(query)).elementMap().toList()
-        return results
+            existing_edge = self.g.V(source_vertex).addE(label).to(target_vertex).next()
+
+        for key, value in properties.items():
+            if value is None:
+                continue
+            # Edge properties are single valued, keep lists as one joined value
+            if isinstance(value, list):
+                value = ",".join(str(item) for item in value)
+            self.g.E(existing_edge).property(key, value).next()
+
+    def bulk_upsert(self, batch):
+        # Gremlin has no portable multi-element upsert for this server version,
+        # so this is the regular per-element merge. Restored elements already
+        # carry their totals, they overwrite instead of accumulating.
+        for node in batch.nodes:
+            self._merge_node(node, accumulate=False)
+        for edge in batch.edges:
+            self._merge_edge(edge, accumulate=False)
+
+    def _stream(self, traversal, page_size):
+        # Remote traversals are fully materialised by toList(), and keyset
+        # paging would re-sort the whole graph per page without an index on
+        # id. Submitted straight to a client, one traversal comes back in
+        # server-side batches of page_size that are handed on as they arrive.
+        client = Client(self.url, 'g')
+        try:
+            result_set = client.submit(traversal.bytecode, request_options={'batchSize': page_size})
+            page = []
+            for results in result_set:
+                # Bytecode results arrive as traversers, which may stand for several equal results
+                for traverser in results:
+                    page.extend([traverser.object] * traverser.bulk)
+                if len(page) >= page_size:
+                    yield page
+                    page = []
+            if page:
+                yield page
+        finally:
+            client.close()
+
+    def iter_nodes(self, page_size=1000):
+        for results in self._stream(self.g.V().valueMap(), page_size):
+            yield [
+                Node.from_properties({key: value[0] if len(value) == 1 else value for key, value in result.items()})
+                for result in results
+            ]
+
+    def iter_edges(self, page_size=1000):
+        traversal = (
+            self.g.E()
+            .project('source', 'target', 'label', 'properties')
+            .by(__.outV().values('id')).by(__.inV().values('id')).by(__.label()).by(__.valueMap())
+        )
+        for results in self._stream(traversal, page_size):
+            yield [
+                Edge.from_properties(result['source'], result['target'], result['label'], result['properties'])
+                for result in results
+            ]
+
+    def mark_stale(self, node_ids, edges):
+        if node_ids:
+            self.g.V().has('id', P.within(list(node_ids))).property(Cardinality.single, 'status', 'stale').iterate()
+        for source, target, label in edges:
+            self.g.V().has('id', source).outE(label).where(__.inV().has('id', target)).property('status', 'stale').iterate()
+
+    def search(self, query, limit=25):
+        results = self.g.V().has('id', TextP.containing(query)).limit(limit).elementMap().toList()
+        return [self._properties(result) for result in results]
+
+    @staticmethod
+    def _properties(element):
+        # elementMap() mixes T.id/T.label tokens in with the stored properties
+        return {key: value for key, value in element.items() if isinstance(key, str)}
+
+    def _nodes(self, node_ids):
+        if not node_ids:
+            return []
+        results = self.g.V().has('id', P.within(list(node_ids))).elementMap().toList()
+        return [self._properties(result) for result in results]
+
+    def neighbourhood(self, node_id, depth=1, limit=200):
+        # Expand one level per round trip instead of a single unbounded repeat()
+        seen = {node_id}
+        frontier = [node_id]
+        edges = {}
+        for _ in range(depth):
+            if not frontier or len(edges) >= limit:
+                break
+            found = (
+                self.g.V().has('id', P.within(frontier)).bothE()
+                .project('source', 'target', 'label', 'properties')
+                .by(__.outV().values('id')).by(__.inV().values('id')).by(__.label()).by(__.valueMap())
+                .limit(limit - len(edges)).toList()
+            )
+            frontier = []
+            for edge in found:
+                key = (edge['source'], edge['target'], edge['label'])
+                edges.setdefault(key, {**edge['properties'], 'source': key[0], 'target': key[1], 'label': key[2]})
+                for vertex_id in key[:2]:
+                    if vertex_id not in seen:
+                        seen.add(vertex_id)
+                        frontier.append(vertex_id)
+
+        return {"nodes": self._nodes(seen), "edges": list(edges.values())}
+
+    def path(self, source, target, max_depth=4):
+        # by() modulators apply round-robin, so vertices yield their id and edges their label
+        paths = (
+            self.g.V().has('id', source)
+            .repeat(__.bothE().otherV().simplePath())
+            .until(__.has('id', target).or_().loops().is_(max_depth))
+            .has('id', target)
+            .path().by('id').by(__.label())
+            .limit(1).toList()
+        )
+        if not paths:
+            return {"nodes": [], "edges": []}
+
+        steps = list(paths[0])
+        edges = [
+            {"source": steps[i], "target": steps[i + 2], "label": steps[i + 1]}
+            for i in range(0, len(steps) - 2, 2)
+        ]
+        return {"nodes": self._nodes(steps[0::2]), "edges": edges}
 
     def visualize(self):
         print("Visualizing graph...")
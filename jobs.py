@@ -1,16 +1,34 @@
 import logging
 from gliner import GLiNER
-import json
 from neo4j import GraphDatabase
 import nltk
 from nltk.tokenize import sent_tokenize
 import re
 from fuzzywuzzy import fuzz
+from cache import publish_invalidation
+from entity_linker import get_linker
+from graph_batch import Edge, GraphBatch, Node
+from graph_stats import GraphStats
+from manifest import Provenance
+from mentions import aggregate_mentions, fold_salience, normalize_name
+from worker import conn
 
 nltk.download('punkt', quiet=True)
 
 logger = logging.getLogger(__name__)
 
+_model = None
+
+
+def get_model():
+    # Loaded once per process; under supervisor.py the parent loads it before
+    # forking so every worker shares the same weights
+    global _model
+    if _model is None:
+        _model = GLiNER.from_pretrained("knowledgator/gliner-multitask-large-v0.5")
+        _model.eval()
+    return _model
+
 
 class Job:
     def __init__(self, profile):
@@ -72,21 +90,16 @@ class Job:
         return entities, relations
 
     @staticmethod
-    def process_entities(entities):
-        nodes = []
-        for entity in entities:
-            node = {
-                "id": Job.generate_node_id(entity["text"]),
-                "status": "active",
-                "type": entity["label"],
-                "label": entity["text"],
-                "data": {
-                    "original_name": entity["text"],
-                    "score": entity["score"]
-                }
-            }
-            nodes.append(node)
-        return nodes
+    def process_entities(entities, chunk_offset=0):
+        return [
+            Node(
+                Job.generate_node_id(entity["text"]),
+                entity["label"],
+                entity["text"],
+                data={"original_name": entity["text"], "score": entity["score"], "chunk_offset": chunk_offset},
+            )
+            for entity in entities
+        ]
 
     @staticmethod
     def generate_node_id(text):
@@ -104,18 +117,7 @@ class Job:
             source_id = Job.generate_node_id(source_text)
             target_id = Job.generate_node_id(target_text)
             
-            edge = {
-                "id": f"{source_id}-{target_id}",
-                "source": source_id,
-                "target": target_id,
-                "status": "active",
-                "type": "directed",
-                "label": relation["label"],
-                "data": {
-                    "score": relation["score"]
-                }
-            }
-            edges.append(edge)
+            edges.append(Edge(source_id, target_id, relation["label"], data={"score": relation["score"]}))
         return edges
 
     @staticmethod
@@ -136,8 +138,7 @@ class Job:
 
     def do(self):
         try:
-            # Load the model inside the method
-            model = GLiNER.from_pretrained("knowledgator/gliner-multitask-large-v0.5")
+            model = get_model()
             
             # Create Neo4j connection inside the method
             driver = GraphDatabase.driver("bolt://neo4j:7687", auth=("neo4j", "securepassword"))
@@ -158,50 +159,50 @@ class Job:
                 logger.error("Invalid content data: missing chunks.")
                 return
 
-            all_nodes = []
-            all_edges = []
+            batch = GraphBatch()
 
+            chunk_offset = 0
             for chunk in chunks.split("\n"):
                 print("chunk", chunk)
                 # Process each chunk
                 entities, relations = self.extract_entities_and_relations(model, chunk)
                 
-                nodes = self.process_entities(entities)
-                all_nodes.extend(nodes)
-                print("nodes:", all_nodes)
+                batch.nodes.extend(self.process_entities(entities, chunk_offset))
+                batch.edges.extend(self.process_relations(relations))
+                chunk_offset += len(chunk) + 1
+
+            # One record per distinct mention, so linking embeds each name once
+            batch = aggregate_mentions(batch)
+            print("nodes:", batch.nodes)
+            print("edges:", batch.edges)
 
-            edges = self.process_relations(relations)                
-            all_edges.extend(edges)
-            print("edges:", all_edges)
+            # Resolve mentions to canonical entities before anything touches the graph
+            get_linker().link(batch)
 
             # Extract additional information from the full text
-            full_text = " ".join(chunks)
-            timeline, facts, leads = self.extract_additional_info(model, full_text)
+            timeline, facts, leads = self.extract_additional_info(model, chunks)
 
             # Process additional information
             for item in timeline + facts + leads:
-                node = {
-                    "id": self.generate_node_id(item["text"]),
-                    "status": "active",
-                    "type": item["label"],
-                    "label": item["text"],
-                    "data": {
-                        "original_text": item["text"],
-                        "score": item["score"]
-                    }
-                }
-                all_nodes.append(node)
-
-            data = {
-                "nodes": all_nodes,
-                "edges": all_edges
-            }
-            
-            json_output = json.dumps(data)
-            
+                batch.nodes.append(Node(
+                    self.generate_node_id(item["text"]),
+                    item["label"],
+                    item["text"],
+                    data={"original_text": item["text"], "score": item["score"]},
+                ))
+
+            # Fold mentions that linked to the same canonical entity, leaving
+            # a single upsert per distinct entity
+            batch = aggregate_mentions(batch)
+
             try:
                 with driver.session() as session:
-                    session.write_transaction(self.merge_data, json_output)
+                    session.write_transaction(self.merge_data, batch)
+                # Never released, so a NuExtract revisit cannot retract these
+                url = (page.get('info') or {}).get('url')
+                Provenance(conn).add(f"gliner:{url or 'anonymous'}", batch)
+                publish_invalidation(conn, batch)
+                GraphStats(conn).record(batch)
             except Exception as e:
                 logger.error(f"Error merging data: {str(e)}")
 
@@ -210,15 +211,15 @@ class Job:
             logger.error(f"Error in do: {str(e)}")
 
     @staticmethod
-    def merge_data(tx, json_data):
-        data = json.loads(json_data)
-        
+    def merge_data(tx, batch):
+        batch = GraphBatch.coerce(batch)
+
         # Merge nodes
-        for node in data.get('nodes', []):
+        for node in batch.nodes:
             Job._merge_node(tx, node)
         
         # Merge edges
-        for edge in data.get('edges', []):
+        for edge in batch.edges:
             Job._merge_edge(tx, edge)
 
     @staticmethod
@@ -228,34 +229,18 @@ class Job:
 
     @staticmethod
     def _normalize_name(name):
-        # Remove common titles and suffixes
-        name = re.sub(r'\b(Dr\.?|Mr\.?|Mrs\.?|Ms\.?|Prof\.?|Ltd\.?|Inc\.?|Corp\.?)\b', '', name, flags=re.IGNORECASE)
-        # Remove punctuation and convert to lowercase
-        return re.sub(r'[^\w\s]', '', name).lower().strip()
-
-    @staticmethod
-    def _flatten_properties(properties):
-        flattened = {}
-        for key, value in properties.items():
-            if isinstance(value, (str, int, float, bool)):
-                flattened[key] = value
-            elif isinstance(value, (list, dict)):
-                flattened[key] = json.dumps(value)
-            else:
-                flattened[key] = str(value)
-        return flattened
+        return normalize_name(name)
 
     @staticmethod
     def _merge_node(tx, node):
-        node_id = node.get('id')
-        if not node_id:
+        if not node.id:
             logger.warning(f"Skipping node due to missing id: {node}")
             return
         
-        label = Job._sanitize_label(node.get('type', 'Entity'))
-        properties = Job._flatten_properties(node)
+        label = Job._sanitize_label(node.type or 'Entity')
+        properties = node.properties()
         
-        normalized_name = Job._normalize_name(properties.get('label', ''))
+        normalized_name = Job._normalize_name(node.label or '')
         
         # Find existing nodes with similar names
         query = (
@@ -277,29 +262,41 @@ class Job:
                 "SET n += $properties "
                 "RETURN n"
             )
+            # The matched node keeps its id, another node may already hold this one
+            properties = {key: value for key, value in fold_salience(dict(existing_node['n']), properties).items() if key != "id"}
             result = tx.run(update_query, node_id=existing_node['n'].id, properties=properties)
         else:
-            # Create new node
+            # Create new node; ids are unique across types through the shared Entity label
+            existing = tx.run("MATCH (n:Entity {id: $id}) RETURN properties(n) AS properties", id=node.id).single()
+            properties = fold_salience(existing and existing["properties"], properties)
             create_query = (
-                f"CREATE (n:{label} $properties) "
-                "SET n.normalized_name = $normalized_name "
+                "MERGE (n:Entity {id: $id}) "
+                f"SET n:{label}, n += $properties, n.normalized_name = $normalized_name "
                 "RETURN n"
             )
-            result = tx.run(create_query, properties=properties, normalized_name=normalized_name)
+            result = tx.run(create_query, id=node.id, properties=properties, normalized_name=normalized_name)
         
         return result.single()
 
     @staticmethod
     def _merge_edge(tx, edge):
-        source = edge.get('source')
-        target = edge.get('target')
-        label = Job._sanitize_label(edge.get('label', 'RELATED_TO'))
+        source = edge.source
+        target = edge.target
+        label = Job._sanitize_label(edge.label or 'RELATED_TO')
         
         if not source or not target:
             logger.warning(f"Skipping edge due to missing source or target: {edge}")
             return
         
-        properties = Job._flatten_properties({k: v for k, v in edge.items() if k not in ['source', 'target', 'label']})
+        source_name = Job._normalize_name(source)
+        target_name = Job._normalize_name(target)
+        existing = tx.run(
+            f"MATCH (source)-[r:{label}]->(target) "
+            "WHERE source.normalized_name = $source_name AND target.normalized_name = $target_name "
+            "RETURN properties(r) AS properties LIMIT 1",
+            source_name=source_name, target_name=target_name,
+        ).single()
+        properties = fold_salience(existing and existing["properties"], edge.properties())
         
         query = (
             "MATCH (source), (target) "
@@ -308,5 +305,5 @@ class Job:
             "SET r += $properties "
             "RETURN r"
         )
-        result = tx.run(query, source_name=Job._normalize_name(source), target_name=Job._normalize_name(target), properties=properties)
+        result = tx.run(query, source_name=source_name, target_name=target_name, properties=properties)
         return result.single()
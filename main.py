@@ -1,19 +1,128 @@
 import logging
 from profile import Profile
 
+from admission import AdmissionController, client_id
+from cache import ANY_WRITE, QueryCache, subscribe_invalidations
 from extract_job import Job
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
+from graph_stats import GraphStats, reconcile
+from mergers import get_merger
 from rq import Queue
 from worker import conn
 
 app = FastAPI()
 q = Queue("nuner", connection=conn)
+admission = AdmissionController(q)
+query_cache = QueryCache()
+graph_stats = GraphStats(conn)
+
+# Bounds on what a single read request may expand to
+MAX_NEIGHBOURHOOD_DEPTH = 3
+MAX_PATH_DEPTH = 6
+MAX_RESULTS = 500
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+@app.on_event("startup")
+def start_cache_invalidation():
+    subscribe_invalidations(conn, query_cache)
+
+
+def _cached(key, query, tags):
+    result = query_cache.get(key)
+    if result is None:
+        generation = query_cache.generation
+        result = query()
+        query_cache.set(key, result, tags(result), generation)
+    return result
+
+
+def _subgraph_ids(result):
+    return {node.get("id") for node in result["nodes"]} | {
+        node_id for edge in result["edges"] for node_id in (edge.get("source"), edge.get("target"))
+    }
+
+
+# Admission and enqueueing talk to Redis and admission holds a thread lock,
+# so these are plain functions that FastAPI runs in its threadpool
 @app.post("/ingress")
-async def ingress(profile: Profile):
+def ingress(profile: Profile, request: Request):
+    client = client_id(request.client.host if request.client else None, request.headers)
+    retry_after, reason = admission.admit(client)
+    if retry_after:
+        logger.warning(f"Rejected ingress from {client}: {reason}")
+        return JSONResponse(
+            status_code=429,
+            headers={"Retry-After": str(retry_after)},
+            content={"message": "Too Many Requests", "reason": reason},
+        )
+
     q.enqueue(Job(profile.dict()).do)
     return {"message": "OK"}
+
+
+@app.get("/metrics")
+def metrics():
+    return admission.metrics()
+
+
+# Read endpoints are plain functions so FastAPI runs the blocking graph
+# queries in its threadpool
+
+
+@app.get("/entities/search")
+def search_entities(query: str, limit: int = 25):
+    if not query:
+        raise HTTPException(status_code=400, detail="Empty query")
+    limit = min(max(limit, 1), MAX_RESULTS)
+    return _cached(
+        ("search", query, limit),
+        lambda: {"nodes": get_merger().search(query, limit)},
+        # Writes to the nodes found invalidate a search; new nodes that start
+        # matching only show up once it expires, the TTL bounds how late
+        lambda result: {node.get("id") for node in result["nodes"]},
+    )
+
+
+@app.get("/entities/{node_id}/neighbourhood")
+def neighbourhood(node_id: str, depth: int = 1, limit: int = 200):
+    depth = min(max(depth, 1), MAX_NEIGHBOURHOOD_DEPTH)
+    limit = min(max(limit, 1), MAX_RESULTS)
+    return _cached(
+        ("neighbourhood", node_id, depth, limit),
+        lambda: get_merger().neighbourhood(node_id, depth, limit),
+        lambda result: _subgraph_ids(result) | {node_id},
+    )
+
+
+@app.get("/paths")
+def path(source: str, target: str, max_depth: int = 4):
+    max_depth = min(max(max_depth, 1), MAX_PATH_DEPTH)
+    return _cached(
+        ("path", source, target, max_depth),
+        lambda: get_merger().path(source, target, max_depth),
+        # A found path goes when one of its elements changes, a shorter one
+        # elsewhere waits for the TTL. Until there is a path, any new edge
+        # can open the first one.
+        lambda result: _subgraph_ids(result) if result["nodes"] else {ANY_WRITE},
+    )
+
+
+@app.get("/cache")
+async def cache_stats():
+    return query_cache.stats()
+
+
+@app.get("/stats")
+def stats(top: int = 10):
+    return graph_stats.snapshot(min(max(top, 1), MAX_RESULTS))
+
+
+@app.post("/stats/reconcile")
+def reconcile_stats():
+    # Counting the graph is slow, leave it to a worker
+    job = q.enqueue(reconcile)
+    return {"message": "OK", "job_id": job.id}
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def chunk_hash(chunk):
+    return hashlib.sha256(chunk.strip().encode("utf-8")).hexdigest()
+
+
+class ChunkManifest:
+    # Per URL: the ordered chunk hashes of the last ingest and the graph
+    # elements each chunk produced, so a revisit only has to extract what changed
+
+    def __init__(self, conn, url):
+        self.conn = conn
+        self.url = url
+        self.key = f"nuner:manifest:{hashlib.sha256(url.encode('utf-8')).hexdigest()}"
+
+    def load(self):
+        raw = self.conn.get(self.key)
+        if not raw:
+            return {}
+        manifest = json.loads(raw)
+        return {entry["hash"]: entry for entry in manifest["chunks"]}
+
+    def save(self, entries):
+        self.conn.set(self.key, json.dumps({"url": self.url, "chunks": entries}))
+
+    @staticmethod
+    def entry(hash, batch):
+        return {
+            "hash": hash,
+            "nodes": sorted({node.id for node in batch.nodes}),
+            "edges": sorted({(edge.source, edge.target, edge.label) for edge in batch.edges}),
+        }
+
+    @staticmethod
+    def diff(previous, hashes):
+        # Returns the positions that need extracting and the entries of chunks
+        # that disappeared from the page
+        seen = set()
+        changed = []
+        for position, hash in enumerate(hashes):
+            if hash not in previous and hash not in seen:
+                changed.append(position)
+            seen.add(hash)
+
+        removed = [entry for hash, entry in previous.items() if hash not in seen]
+        return changed, removed
+
+    @staticmethod
+    def stale_elements(removed, entries):
+        # Elements are shared between chunks, only retract what no remaining chunk still produces
+        live_nodes = {node for entry in entries for node in entry["nodes"]}
+        live_edges = {tuple(edge) for entry in entries for edge in entry["edges"]}
+
+        stale_nodes = {node for entry in removed for node in entry["nodes"]} - live_nodes
+        stale_edges = {tuple(edge) for entry in removed for edge in entry["edges"]} - live_edges
+        return sorted(stale_nodes), sorted(stale_edges)
+
+
+class Provenance:
+    # Manifests are per URL but the graph is shared, so every element keeps
+    # the set of sources that produce it. A page that stops producing an
+    # element only retracts it once no other source still does.
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    @staticmethod
+    def _node_key(node_id):
+        return f"nuner:sources:node:{node_id}"
+
+    @staticmethod
+    def _edge_key(source, target, label):
+        return f"nuner:sources:edge:{source}\x1f{label}\x1f{target}"
+
+    def add(self, source, batch):
+        pipe = self.conn.pipeline(transaction=False)
+        for node in batch.nodes:
+            pipe.sadd(self._node_key(node.id), source)
+        for edge in batch.edges:
+            pipe.sadd(self._edge_key(edge.source, edge.target, edge.label), source)
+        pipe.execute()
+
+    def release(self, source, nodes, edges):
+        # Drops the source from the given elements and returns those that no
+        # source produces any more; Redis deletes a set once it is empty
+        keys = [self._node_key(node_id) for node_id in nodes] + [self._edge_key(*edge) for edge in edges]
+        pipe = self.conn.pipeline(transaction=True)
+        for key in keys:
+            pipe.srem(key, source)
+            pipe.scard(key)
+        remaining = pipe.execute()[1::2]
+
+        orphaned_nodes = [node_id for node_id, count in zip(nodes, remaining) if not count]
+        orphaned_edges = [tuple(edge) for edge, count in zip(edges, remaining[len(nodes):]) if not count]
+        return orphaned_nodes, orphaned_edges
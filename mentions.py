@@ -0,0 +1,100 @@
+import re
+
+from graph_batch import GraphBatch
+
+
+def normalize_name(name):
+    # Remove common titles and suffixes
+    name = re.sub(r'\b(Dr\.?|Mr\.?|Mrs\.?|Ms\.?|Prof\.?|Ltd\.?|Inc\.?|Corp\.?)\b', '', name, flags=re.IGNORECASE)
+    # Remove punctuation and convert to lowercase
+    return re.sub(r'[^\w\s]', '', name).lower().strip()
+
+
+def aggregate_mentions(batch, id_map=None):
+    # Collapse repeated mentions into one node per (type, normalized name)
+    # and one edge per (source, target, label). Inputs may already be
+    # aggregates, so counts and scores are folded by weight. Ids of folded
+    # nodes are recorded in id_map, when given, as old id -> kept id.
+    if id_map is None:
+        id_map = {}
+
+    folded = {}
+    nodes = {}
+    for node in batch.nodes:
+        key = (node.type, normalize_name(node.label or ''))
+        data = node.data
+        count = data.get("mention_count", 1)
+        # NuExtract gives no confidence, only count what was actually scored
+        scored = count if "score" in data or "mean_score" in data else 0
+        score = data.get("score", 0.0)
+        if "chunk_offsets" in data:
+            offsets = data["chunk_offsets"]
+        else:
+            offsets = [data["chunk_offset"]] if "chunk_offset" in data else []
+
+        aggregate = nodes.get(key)
+        if aggregate is None:
+            aggregate = nodes[key] = [node, 0, 0.0, 0.0, 0, set()]
+        else:
+            folded.setdefault(node.id, aggregate[0].id)
+        aggregate[1] += count
+        if scored:
+            aggregate[2] = max(aggregate[2], data.get("max_score", score))
+            aggregate[3] += data.get("mean_score", score) * scored
+            aggregate[4] += scored
+        aggregate[5].update(offsets)
+
+    aggregated_nodes = []
+    for node, count, max_score, score_total, scored, offsets in nodes.values():
+        node.data.pop("chunk_offset", None)
+        node.data["mention_count"] = count
+        if scored:
+            node.data.update(score=max_score, max_score=max_score, mean_score=score_total / scored)
+        if offsets:
+            node.data["chunk_offsets"] = sorted(offsets)
+        aggregated_nodes.append(node)
+
+    # An id that is still carried by a node of another type keeps pointing there
+    kept = {node.id for node in aggregated_nodes}
+    id_map.update((old, new) for old, new in folded.items() if old not in kept)
+
+    # Edges still point at the ids of the mentions folded away above
+    edges = {}
+    for edge in batch.edges:
+        if edge.source in id_map or edge.target in id_map:
+            edge.source = id_map.get(edge.source, edge.source)
+            edge.target = id_map.get(edge.target, edge.target)
+            edge.id = f"{edge.source}-{edge.target}"
+
+        key = (edge.source, edge.target, edge.label)
+        count = edge.data.get("mention_count", 1)
+        existing = edges.get(key)
+        if existing is None:
+            edge.data["mention_count"] = count
+            edges[key] = edge
+        else:
+            existing.data["mention_count"] += count
+            existing.data["score"] = max(existing.data.get("score", 0.0), edge.data.get("score", 0.0))
+
+    return GraphBatch(aggregated_nodes, list(edges.values()))
+
+
+def fold_salience(existing, properties):
+    # Salience describes every ingest of an element, not the latest one:
+    # counts add up, maxima are kept and the mean is weighted by the counts.
+    # chunk_offsets stays per ingest, it only means something for the page
+    # that was just written. existing and properties are flat property maps
+    # (or Node/Edge data); anything without a mention_count is left as is.
+    count = properties.get("mention_count")
+    previous = existing.get("mention_count") if existing else None
+    if count is None or not previous:
+        return properties
+
+    folded = dict(properties)
+    folded["mention_count"] = previous + count
+    for key in ("score", "max_score"):
+        if key in properties and existing.get(key) is not None:
+            folded[key] = max(existing[key], properties[key])
+    if "mean_score" in properties and existing.get("mean_score") is not None:
+        folded["mean_score"] = (existing["mean_score"] * previous + properties["mean_score"] * count) / (previous + count)
+    return folded
@@ -0,0 +1,44 @@
+import os
+
+graph_backend = os.getenv("GRAPH_BACKEND", "neo4j")
+
+_merger = None
+
+
+def create_merger(backend=graph_backend):
+    # Imports stay local so a deployment only needs the client of the backend it uses
+    if backend == "neo4j":
+        from neo4j_merger import Neo4jGraphMerger
+        return Neo4jGraphMerger(
+            os.getenv("NEO4J_URI", "bolt://neo4j:7687"),
+            os.getenv("NEO4J_USER", "neo4j"),
+            os.getenv("NEO4J_PASSWORD", "securepassword"),
+        )
+    if backend == "janusgraph":
+        from janusgraph_merger import JanusGraphMerger
+        return JanusGraphMerger(os.getenv("JANUSGRAPH_HOST", "janusgraph"), int(os.getenv("JANUSGRAPH_PORT", "8182")))
+    if backend == "arangodb":
+        from arangodb import ArangoDBGraphMerger
+        return ArangoDBGraphMerger(
+            os.getenv("ARANGODB_HOST", "arangodb"),
+            int(os.getenv("ARANGODB_PORT", "8529")),
+            os.getenv("ARANGODB_DATABASE", "_system"),
+            os.getenv("ARANGODB_USER", "root"),
+            os.getenv("ARANGODB_PASSWORD", ""),
+        )
+    if backend == "tigergraph":
+        from tigergraph_merger import TigerGraphMerger
+        return TigerGraphMerger(
+            os.getenv("TIGERGRAPH_HOST", "http://tigergraph"),
+            os.getenv("TIGERGRAPH_GRAPH", "knowledge_graph"),
+            os.getenv("TIGERGRAPH_USER", "tigergraph"),
+            os.getenv("TIGERGRAPH_PASSWORD", "tigergraph"),
+        )
+    raise ValueError(f"Unknown graph backend: {backend}")
+
+
+def get_merger():
+    global _merger
+    if _merger is None:
+        _merger = create_merger()
+    return _merger
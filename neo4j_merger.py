@@ -1,27 +1,63 @@
 from neo4j import GraphDatabase
-import json
+from graph_batch import Edge, GraphBatch, Node
+from mentions import fold_salience
+import argparse
 import logging
+import os
 import re
 
 logger = logging.getLogger(__name__)
 
 class Neo4jGraphMerger:
-    def __init__(self, uri, user, password):
+    # Every node also carries the shared Entity label, whose unique id
+    # constraint gives lookups by id an index whatever the node's type
+    def __init__(self, uri, user, password, ensure_schema=True):
         self.driver = GraphDatabase.driver(uri, auth=(user, password))
+        if ensure_schema:
+            self._ensure_schema()
+
+    def _ensure_schema(self):
+        with self.driver.session() as session:
+            # Writes MERGE on :Entity, so a node from before the label existed
+            # would silently get a duplicate instead of being updated. The
+            # count store answers both counts without scanning the graph.
+            total = session.run("MATCH (n) RETURN count(n) AS count").single()["count"]
+            labelled = session.run("MATCH (n:Entity) RETURN count(n) AS count").single()["count"]
+            if total > labelled and session.run(
+                "MATCH (n) WHERE n.id IS NOT NULL AND NOT n:Entity RETURN n.id LIMIT 1"
+            ).single():
+                raise RuntimeError(
+                    "The graph has nodes without the Entity label, stop all workers and run "
+                    "`python neo4j_merger.py label-entities` once before starting this version"
+                )
+            session.run("CREATE CONSTRAINT entity_id IF NOT EXISTS FOR (n:Entity) REQUIRE n.id IS UNIQUE").consume()
+            # Backs the CONTAINS in search
+            session.run("CREATE TEXT INDEX entity_id_text IF NOT EXISTS FOR (n:Entity) ON (n.id)").consume()
+
+    def label_entities(self):
+        # One-off for graphs written before the Entity label existed, run
+        # before the constraint exists; creating it afterwards fails if two
+        # nodes share an id, and those have to be merged by hand
+        with self.driver.session() as session:
+            result = session.run(
+                "MATCH (n) WHERE n.id IS NOT NULL AND NOT n:Entity "
+                "CALL { WITH n SET n:Entity } IN TRANSACTIONS OF 10000 ROWS"
+            )
+            return result.consume().counters.labels_added
 
     def close(self):
         self.driver.close()
 
     def merge_data(self, new_data):
         with self.driver.session() as session:
-            data = json.loads(new_data)
+            batch = GraphBatch.coerce(new_data)
             
             # Merge nodes
-            for node in data.get('nodes', []):
+            for node in batch.nodes:
                 session.write_transaction(self._merge_node, node)
             
             # Merge edges
-            for edge in data.get('edges', []):
+            for edge in batch.edges:
                 session.write_transaction(self._merge_edge, edge)
 
     @staticmethod
@@ -29,35 +65,24 @@ class Neo4jGraphMerger:
         # Capitalize and remove any non-alphanumeric characters
         return re.sub(r'\W+', '', label.title())
 
-    @staticmethod
-    def _flatten_properties(properties):
-        flattened = {}
-        for key, value in properties.items():
-            if isinstance(value, (str, int, float, bool)):
-                flattened[key] = value
-            elif isinstance(value, (list, dict)):
-                flattened[key] = json.dumps(value)
-            else:
-                flattened[key] = str(value)
-        return flattened
-
     @staticmethod
     def _merge_node(tx, node):
-        node_id = node.get('id')
+        node_id = node.id
         if not node_id:
             logger.warning(f"Skipping node due to missing id: {node}")
             return
         
         # Get the label from the 'type' property, or use 'Entity' as default
-        label = Neo4jGraphMerger._sanitize_label(node.get('type', 'Entity'))
+        label = Neo4jGraphMerger._sanitize_label(node.type or 'Entity')
         
-        # Prepare node properties
-        properties = Neo4jGraphMerger._flatten_properties(node)
+        # Prepare node properties; mention counts and scores add up over ingests
+        existing = tx.run("MATCH (n:Entity {id: $id}) RETURN properties(n) AS properties", id=node_id).single()
+        properties = fold_salience(existing and existing["properties"], node.properties())
         
         # Merge node
         query = (
-            f"MERGE (n:{label} {{id: $id}}) "
-            "SET n += $properties "
+            "MERGE (n:Entity {id: $id}) "
+            f"SET n:{label}, n += $properties "
             "RETURN n"
         )
         result = tx.run(query, id=node_id, properties=properties)
@@ -65,20 +90,24 @@ class Neo4jGraphMerger:
 
     @staticmethod
     def _merge_edge(tx, edge):
-        source = edge.get('source')
-        target = edge.get('target')
-        label = Neo4jGraphMerger._sanitize_label(edge.get('label', 'RELATED_TO'))
+        source = edge.source
+        target = edge.target
+        label = Neo4jGraphMerger._sanitize_label(edge.label or 'RELATED_TO')
         
         if not source or not target:
             logger.warning(f"Skipping edge due to missing source or target: {edge}")
             return
         
         # Prepare edge properties
-        properties = Neo4jGraphMerger._flatten_properties({k: v for k, v in edge.items() if k not in ['source', 'target', 'label']})
+        existing = tx.run(
+            f"MATCH (:Entity {{id: $source}})-[r:{label}]->(:Entity {{id: $target}}) RETURN properties(r) AS properties",
+            source=source, target=target,
+        ).single()
+        properties = fold_salience(existing and existing["properties"], edge.properties())
         
         # Merge edge
         query = (
-            "MATCH (source {id: $source}), (target {id: $target}) "
+            "MATCH (source:Entity {id: $source}), (target:Entity {id: $target}) "
             f"MERGE (source)-[r:{label}]->(target) "
             "SET r += $properties "
             "RETURN r"
@@ -86,20 +115,147 @@ class Neo4jGraphMerger:
         result = tx.run(query, source=source, target=target, properties=properties)
         return result.single()
 
-    def search(self, query):
+    def bulk_upsert(self, batch, chunk_size=1000):
+        # One UNWIND per label and chunk instead of a transaction per element.
+        # Restored elements already carry their totals, so unlike merge_data
+        # this overwrites salience instead of accumulating it.
+        nodes = {}
+        for node in batch.nodes:
+            if node.id:
+                nodes.setdefault(self._sanitize_label(node.type or 'Entity'), []).append(
+                    {"id": node.id, "properties": node.properties()}
+                )
+        edges = {}
+        for edge in batch.edges:
+            if edge.source and edge.target:
+                edges.setdefault(self._sanitize_label(edge.label or 'RELATED_TO'), []).append(
+                    {"source": edge.source, "target": edge.target, "properties": edge.properties()}
+                )
+
+        with self.driver.session() as session:
+            for label, rows in nodes.items():
+                query = f"UNWIND $rows AS row MERGE (n:Entity {{id: row.id}}) SET n:{label}, n += row.properties"
+                for start in range(0, len(rows), chunk_size):
+                    session.write_transaction(self._run_rows, query, rows[start:start + chunk_size])
+            for label, rows in edges.items():
+                query = (
+                    "UNWIND $rows AS row "
+                    "MATCH (source:Entity {id: row.source}), (target:Entity {id: row.target}) "
+                    f"MERGE (source)-[r:{label}]->(target) "
+                    "SET r += row.properties"
+                )
+                for start in range(0, len(rows), chunk_size):
+                    session.write_transaction(self._run_rows, query, rows[start:start + chunk_size])
+
+    @staticmethod
+    def _run_rows(tx, query, rows):
+        tx.run(query, rows=rows).consume()
+
+    def iter_nodes(self, page_size=1000):
+        # The driver pulls records fetch_size at a time, so a single streaming
+        # query stays in bounded memory without paging through the graph
+        with self.driver.session(fetch_size=page_size) as session:
+            result = session.run("MATCH (n) RETURN n")
+            page = []
+            for record in result:
+                page.append(Node.from_properties(dict(record["n"])))
+                if len(page) >= page_size:
+                    yield page
+                    page = []
+            if page:
+                yield page
+
+    def iter_edges(self, page_size=1000):
+        with self.driver.session(fetch_size=page_size) as session:
+            result = session.run(
+                "MATCH (source)-[r]->(target) "
+                "RETURN source.id AS source, target.id AS target, type(r) AS label, properties(r) AS properties"
+            )
+            page = []
+            for record in result:
+                page.append(Edge.from_properties(record["source"], record["target"], record["label"], record["properties"]))
+                if len(page) >= page_size:
+                    yield page
+                    page = []
+            if page:
+                yield page
+
+    def mark_stale(self, node_ids, edges):
         with self.driver.session() as session:
-            result = session.read_transaction(self._search, query)
+            session.write_transaction(self._mark_stale, node_ids, edges)
+
+    @staticmethod
+    def _mark_stale(tx, node_ids, edges):
+        tx.run("MATCH (n:Entity) WHERE n.id IN $ids SET n.status = 'stale'", ids=list(node_ids))
+        for source, target, label in edges:
+            query = (
+                f"MATCH (source:Entity {{id: $source}})-[r:{Neo4jGraphMerger._sanitize_label(label)}]->(target:Entity {{id: $target}}) "
+                "SET r.status = 'stale'"
+            )
+            tx.run(query, source=source, target=target)
+
+    def search(self, query, limit=25):
+        with self.driver.session() as session:
+            result = session.read_transaction(self._search, query, limit)
             return result
 
     @staticmethod
-    def _search(tx, query):
+    def _search(tx, query, limit=25):
         cypher_query = (
-            "MATCH (n) "
+            "MATCH (n:Entity) "
             "WHERE n.id CONTAINS $query "
-            "RETURN n"
+            "RETURN n "
+            "LIMIT $limit"
         )
-        result = tx.run(cypher_query, query=query)
-        return [record["n"] for record in result]
+        result = tx.run(cypher_query, query=query, limit=limit)
+        return [dict(record["n"]) for record in result]
+
+    def neighbourhood(self, node_id, depth=1, limit=200):
+        with self.driver.session() as session:
+            return session.read_transaction(self._neighbourhood, node_id, depth, limit)
+
+    @staticmethod
+    def _neighbourhood(tx, node_id, depth, limit):
+        # Variable length bounds cannot be parameters, depth is an int from the caller
+        query = (
+            f"MATCH p = (n:Entity {{id: $id}})-[*1..{int(depth)}]-() "
+            "WITH p LIMIT $limit "
+            "UNWIND relationships(p) AS r "
+            "RETURN DISTINCT startNode(r) AS source, r, endNode(r) AS target"
+        )
+        result = tx.run(query, id=node_id, limit=limit)
+        return Neo4jGraphMerger._subgraph(result)
+
+    def path(self, source, target, max_depth=4):
+        with self.driver.session() as session:
+            return session.read_transaction(self._path, source, target, max_depth)
+
+    @staticmethod
+    def _path(tx, source, target, max_depth):
+        query = (
+            "MATCH (s:Entity {id: $source}), (t:Entity {id: $target}) "
+            f"MATCH p = shortestPath((s)-[*..{int(max_depth)}]-(t)) "
+            "UNWIND relationships(p) AS r "
+            "RETURN startNode(r) AS source, r, endNode(r) AS target"
+        )
+        result = tx.run(query, source=source, target=target)
+        return Neo4jGraphMerger._subgraph(result)
+
+    @staticmethod
+    def _subgraph(records):
+        nodes = {}
+        edges = []
+        for record in records:
+            source, target = dict(record["source"]), dict(record["target"])
+            nodes[source.get("id")] = source
+            nodes[target.get("id")] = target
+            edges.append({
+                **dict(record["r"]),
+                "source": source.get("id"),
+                "target": target.get("id"),
+                "label": record["r"].type,
+            })
+        return {"nodes": list(nodes.values()), "edges": edges}
 
     def visualize(self):
         with self.driver.session() as session:
@@ -110,3 +266,23 @@ class Neo4jGraphMerger:
 
 # Example usage
 # merger = Neo4jGraphMerger("bolt://localhost:7687", "neo4j", "password")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Neo4j schema maintenance")
+    parser.add_argument("command", choices=["label-entities"])
+    args = parser.parse_args()
+
+    merger = Neo4jGraphMerger(
+        os.getenv("NEO4J_URI", "bolt://neo4j:7687"),
+        os.getenv("NEO4J_USER", "neo4j"),
+        os.getenv("NEO4J_PASSWORD", "securepassword"),
+        ensure_schema=False,
+    )
+    try:
+        logger.info(f"Labelled {merger.label_entities()} nodes as Entity")
+        merger._ensure_schema()
+    finally:
+        merger.close()
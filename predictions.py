@@ -0,0 +1,141 @@
+import json
+import logging
+import re
+
+from graph_batch import Edge, GraphBatch, Node
+
+logger = logging.getLogger(__name__)
+
+# Turning NuExtract output into graph elements; kept apart from extract_job
+# so none of it needs the model loaded
+
+
+def split_windows(tokenizer, text, window_tokens, overlap):
+    # Slice the original text on token boundaries so each window fits the
+    # budget exactly; the overlap keeps entities on a boundary intact in
+    # at least one window
+    encoding = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+    offsets = encoding["offset_mapping"]
+    if len(offsets) <= window_tokens:
+        return [text]
+
+    step = max(1, window_tokens - overlap)
+    windows = []
+    for start in range(0, len(offsets), step):
+        end = min(start + window_tokens, len(offsets))
+        windows.append(text[offsets[start][0]:offsets[end - 1][1]])
+        if end == len(offsets):
+            break
+    return windows
+
+
+def parse_prediction(output):
+    # NuExtract output is usually valid JSON, but windows cut off by
+    # max_new_tokens end mid-object. Recover what is there instead of
+    # dropping the whole window.
+    start = output.find("{")
+    if start == -1:
+        return {}
+    text = output[start:]
+
+    try:
+        parsed = json.loads(text)
+        return parsed if isinstance(parsed, dict) else {}
+    except json.JSONDecodeError:
+        pass
+
+    # Drop trailing commas, then back off to the last complete object or
+    # list and close whatever is still open around it
+    text = re.sub(r",\s*([\]}])", r"\1", text)
+    cuts = [len(text)] + [i + 1 for i in range(len(text) - 1, -1, -1) if text[i] in "}]"]
+    for cut in cuts:
+        candidate = close_json(text[:cut].rstrip().rstrip(","))
+        if candidate is None:
+            continue
+        try:
+            recovered = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        return recovered if isinstance(recovered, dict) else {}
+
+    logger.warning(f"Could not recover JSON from prediction: {output[:200]}")
+    return {}
+
+
+def close_json(text):
+    stack = []
+    in_string = False
+    escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]":
+            if not stack or stack.pop() != char:
+                return None
+
+    if in_string:
+        return None
+    return text + "".join(reversed(stack))
+
+
+def generate_node_id(text):
+    return re.sub(r"[^\w\s-]", "", text).strip().lower().replace(" ", "-")
+
+
+def merge_predictions(predictions):
+    # Windows overlap and the model invents its own ids per window, so
+    # nodes are keyed on (type, name) and edges are rewritten to those keys
+    nodes = {}
+    edges = {}
+
+    for prediction in predictions:
+        local_ids = {}
+        for item in prediction.get("nodes") or []:
+            if not isinstance(item, dict):
+                continue
+            name = str(item.get("name") or item.get("id") or "").strip()
+            node_id = generate_node_id(name)
+            if not node_id:
+                continue
+
+            node_type = str(item.get("type") or "entity").strip().lower()
+            local_ids[str(item.get("id") or name)] = node_id
+            local_ids[name] = node_id
+
+            data = {
+                key: value for key, value in item.items()
+                if key not in ("id", "name", "type", "status") and value not in ("", [], None)
+            }
+            node = nodes.get((node_type, node_id))
+            if node is None:
+                nodes[(node_type, node_id)] = Node(node_id, node_type, name, item.get("status") or "active", data)
+            else:
+                for key, value in data.items():
+                    if isinstance(value, list) and isinstance(node.data.get(key), list):
+                        node.data[key] = node.data[key] + [v for v in value if v not in node.data[key]]
+                    else:
+                        node.data.setdefault(key, value)
+
+        for item in prediction.get("edges") or []:
+            if not isinstance(item, dict):
+                continue
+            source = str(item.get("source") or "").strip()
+            target = str(item.get("target") or "").strip()
+            source = local_ids.get(source, generate_node_id(source))
+            target = local_ids.get(target, generate_node_id(target))
+            if not source or not target:
+                continue
+
+            label = str(item.get("label") or "RELATED_TO").strip()
+            edges.setdefault((source, target, label), Edge(source, target, label, status=item.get("status") or "active"))
+
+    return GraphBatch(list(nodes.values()), list(edges.values()))
@@ -0,0 +1,198 @@
+import argparse
+import gc
+import logging
+import os
+import signal
+import time
+
+import torch
+from rq import Connection, Queue, Worker
+
+from worker import conn, listen
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+workers = int(os.getenv("NUNER_WORKERS", os.cpu_count() or 1))
+preload_models = os.getenv("NUNER_PRELOAD", "nuextract,linker")
+report_interval = int(os.getenv("NUNER_MEMORY_REPORT_INTERVAL", "60"))
+# A worker that dies sooner than this after starting counts as a failed
+# start, and repeated failed starts back off up to max_restart_delay
+min_uptime = 30
+max_restart_delay = 300
+
+
+def _freeze(model):
+    # Nothing may write to the weights after the fork, or the pages stop
+    # being shared and every worker ends up with its own copy again
+    model.eval()
+    for parameter in model.parameters():
+        parameter.requires_grad_(False)
+    return model
+
+
+def preload(names):
+    torch.set_grad_enabled(False)
+
+    for name in names:
+        logger.info(f"Preloading model: {name}")
+        if name == "gliner":
+            import jobs
+            _freeze(jobs.get_model())
+        elif name == "nuextract":
+            import extract_job
+            _freeze(extract_job.model)
+        elif name == "linker":
+            from entity_linker import get_linker
+            linker = get_linker()
+            _freeze(linker.model)
+            logger.info(f"Loaded {linker.load_indexes()} entity indexes")
+        else:
+            raise ValueError(f"Unknown model to preload: {name}")
+
+    # Move everything allocated so far out of the collector's reach, so gc
+    # passes in the children do not touch (and copy) the parent's pages
+    gc.collect()
+    gc.freeze()
+
+
+def memory_usage(pid):
+    usage = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                usage[parts[0].rstrip(":")] = int(parts[1]) * 1024
+
+    return {
+        "rss": usage.get("Rss", 0),
+        "pss": usage.get("Pss", 0),
+        "shared": usage.get("Shared_Clean", 0) + usage.get("Shared_Dirty", 0),
+        "unique": usage.get("Private_Clean", 0) + usage.get("Private_Dirty", 0),
+    }
+
+
+def _descendants(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+    return children + [grandchild for child in children for grandchild in _descendants(child)]
+
+
+def report_memory(pids):
+    for pid in pids:
+        # rq runs each job in a forked work horse, count it towards its worker
+        totals = {"rss": 0, "pss": 0, "shared": 0, "unique": 0}
+        for process in [pid] + _descendants(pid):
+            try:
+                usage = memory_usage(process)
+            except OSError:
+                continue
+            for key, value in usage.items():
+                totals[key] += value
+
+        mb = {key: value / (1024 * 1024) for key, value in totals.items()}
+        logger.info(
+            f"Worker {pid}: unique {mb['unique']:.1f} MiB, shared {mb['shared']:.1f} MiB, "
+            f"pss {mb['pss']:.1f} MiB, rss {mb['rss']:.1f} MiB"
+        )
+
+
+def _run_worker(threads):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    torch.set_num_threads(threads)
+
+    with Connection(conn):
+        worker = Worker(map(Queue, listen))
+        worker.work()
+
+
+def spawn(threads):
+    pid = os.fork()
+    if pid == 0:
+        # The child must never return into the supervisor loop, but its
+        # failure still has to reach the log and the exit status
+        code = 1
+        try:
+            _run_worker(threads)
+            code = 0
+        except Exception:
+            logger.exception(f"Worker {os.getpid()} crashed")
+        finally:
+            logging.shutdown()
+            os._exit(code)
+    logger.info(f"Started worker {pid}")
+    return pid
+
+
+def supervise(count, models, interval):
+    preload(models)
+
+    # Split the cores between the workers instead of letting each one grab all of them
+    threads = max(1, (os.cpu_count() or 1) // count)
+    # Each pid maps to its worker slot and start time; crash loops are
+    # counted per slot so one failing worker does not slow down the others
+    pids = {spawn(threads): (slot, time.monotonic()) for slot in range(count)}
+    failures = [0] * count
+    # Due times and slots of workers waiting to be restarted
+    pending = []
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        pending.clear()
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    last_report = 0
+    while pids or pending:
+        now = time.monotonic()
+        for due, slot in [entry for entry in pending if entry[0] <= now]:
+            pending.remove((due, slot))
+            pids[spawn(threads)] = (slot, now)
+
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG) if pids else (0, 0)
+        except ChildProcessError:
+            pid = 0
+            pids.clear()
+
+        if pid:
+            slot, started = pids.pop(pid)
+            if not stopping:
+                # A crash loop (bad model file, unreachable Redis) must not
+                # fork a fresh worker every second
+                failures[slot] = failures[slot] + 1 if now - started < min_uptime else 0
+                delay = min(max_restart_delay, 2 ** failures[slot]) if failures[slot] else 0
+                logger.warning(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, "
+                               f"restarting in {delay}s")
+                pending.append((now + delay, slot))
+            continue
+
+        if interval and time.monotonic() - last_report >= interval:
+            logger.info(f"Supervisor {os.getpid()}: {memory_usage(os.getpid())['rss'] / (1024 * 1024):.1f} MiB rss")
+            report_memory(sorted(pids))
+            last_report = time.monotonic()
+
+        time.sleep(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run several rq workers sharing preloaded model weights")
+    parser.add_argument("--workers", type=int, default=workers)
+    parser.add_argument("--models", default=preload_models, help="comma separated: gliner, nuextract, linker")
+    parser.add_argument("--report-interval", type=int, default=report_interval)
+    args = parser.parse_args()
+
+    supervise(args.workers, [name for name in args.models.split(",") if name], args.report_interval)
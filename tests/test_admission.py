@@ -0,0 +1,98 @@
+import pytest
+
+pytest.importorskip("rq")
+
+import admission  # noqa: E402
+from admission import AdmissionController  # noqa: E402
+
+
+class FakeQueue:
+    def __init__(self):
+        self.count = 0
+
+
+class Controller(AdmissionController):
+    # Feeds the samples directly instead of reading rq's keys
+    def __init__(self, **kwargs):
+        super().__init__(FakeQueue(), high_watermark=10, low_watermark=5, age_high=100, age_low=50, **kwargs)
+        self.age = 0.0
+        self.done = 0
+
+    def _oldest_age(self):
+        return self.age
+
+    def _completed_jobs(self):
+        return self.done
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(admission.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_completion_rate_spans_the_window_not_the_last_sample(clock):
+    controller = Controller()
+    for _ in range(30):
+        controller.done += 2
+        clock[0] += 1
+        controller.sample()
+    # A burst of metrics scrapes leaves the rate alone
+    for _ in range(5):
+        controller.metrics()
+
+    assert controller.completion_rate == pytest.approx(2.0)
+
+
+def test_completion_rate_ignores_worker_counter_resets(clock):
+    controller = Controller()
+    for done in (10, 20, 0, 10):
+        controller.done = done
+        clock[0] += 1
+        controller.sample()
+
+    assert controller.completion_rate == pytest.approx(20 / 3)
+
+
+def test_shed_reason_is_the_watermark_that_tripped(clock):
+    controller = Controller()
+    controller.age = 150
+    clock[0] += 1
+
+    assert controller.admit("client") == (30, "queue_age")
+
+    # Still shedding inside the hysteresis band, for the same reason
+    controller.queue.count = 8
+    controller.age = 80
+    clock[0] += 1
+    assert controller.admit("client")[1] == "queue_age"
+
+    controller.queue.count = 0
+    controller.age = 0
+    clock[0] += 1
+    assert controller.admit("client") == (0, None)
+    assert controller.metrics()["rejected_total"]["queue_age"] == 2
+
+
+def test_client_id_only_trusts_headers_from_proxies():
+    headers = {"X-Client-Id": "spoofed", "X-Forwarded-For": "203.0.113.7, 10.0.0.2"}
+
+    assert admission.client_id("198.51.100.1", headers, trusted={"10.0.0.1"}) == "198.51.100.1"
+    assert admission.client_id("10.0.0.1", headers, trusted={"10.0.0.1"}) == "spoofed"
+    assert admission.client_id("10.0.0.1", {"X-Forwarded-For": "203.0.113.7, 10.0.0.2"}, trusted={"10.0.0.1"}) == "10.0.0.2"
+    assert admission.client_id(None, headers, trusted=set()) == "unknown"
+
+
+def test_oldest_age_of_a_deleted_head_job(monkeypatch):
+    class Queue:
+        connection = None
+
+        def get_job_ids(self, offset, length):
+            return ["gone"]
+
+    def fetch(job_id, connection):
+        raise admission.NoSuchJobError(job_id)
+
+    monkeypatch.setattr(admission.RQJob, "fetch", fetch)
+    assert AdmissionController(Queue())._oldest_age() == 0.0
@@ -0,0 +1,84 @@
+from cache import ANY_WRITE, QueryCache
+
+
+def test_invalidate_drops_tagged_entries_only():
+    cache = QueryCache()
+    cache.set("a", 1, {"x"})
+    cache.set("b", 2, {"y"})
+
+    assert cache.invalidate(["x"]) == 1
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+
+
+def test_any_write_entries_drop_on_every_invalidation():
+    cache = QueryCache()
+    cache.set("path", 1, {ANY_WRITE})
+
+    cache.invalidate(["unrelated"])
+
+    assert cache.get("path") is None
+
+
+def test_result_raced_by_an_overlapping_write_is_not_cached():
+    cache = QueryCache()
+    generation = cache.generation
+    cache.invalidate(["x"])
+
+    cache.set("a", 1, {"x", "y"}, generation)
+
+    assert cache.get("a") is None
+
+
+def test_result_raced_by_an_unrelated_write_is_cached():
+    cache = QueryCache()
+    generation = cache.generation
+    cache.invalidate(["z"])
+
+    cache.set("a", 1, {"x"}, generation)
+
+    assert cache.get("a") == 1
+
+
+def test_any_write_result_raced_by_any_write_is_not_cached():
+    cache = QueryCache()
+    generation = cache.generation
+    cache.invalidate(["z"])
+
+    cache.set("path", 1, {ANY_WRITE}, generation)
+
+    assert cache.get("path") is None
+
+
+def test_forgotten_invalidations_are_assumed_to_overlap():
+    cache = QueryCache()
+    generation = cache.generation
+    for i in range(cache.recent.maxlen + 1):
+        cache.invalidate([f"n{i}"])
+
+    cache.set("a", 1, {"x"}, generation)
+
+    assert cache.get("a") is None
+
+
+def test_clear_invalidates_results_in_flight():
+    cache = QueryCache()
+    generation = cache.generation
+    cache.clear()
+
+    cache.set("a", 1, {"x"}, generation)
+
+    assert cache.get("a") is None
+
+
+def test_expired_and_evicted_entries():
+    cache = QueryCache(size=2, ttl=-1)
+    cache.set("a", 1, {"x"})
+    assert cache.get("a") is None
+
+    cache = QueryCache(size=2)
+    for key in "abc":
+        cache.set(key, key, {key})
+    assert cache.get("a") is None
+    assert cache.tags.get("a") is None
+    assert cache.stats()["entries"] == 2
@@ -0,0 +1,159 @@
+import os
+import sys
+import types
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("hnswlib")
+
+from entity_linker import EntityIndex, EntityLinker  # noqa: E402
+from graph_batch import Edge, GraphBatch, Node  # noqa: E402
+
+DIM = 8
+
+
+class StubEncoder:
+    # Names map to fixed unit vectors; names listed together in ALIASES share one
+    ALIASES = [{"Apple", "Apple Inc."}, {"Tim Cook", "Timothy Cook"}]
+
+    def __init__(self, model_name):
+        pass
+
+    def get_sentence_embedding_dimension(self):
+        return DIM
+
+    def encode(self, texts, **kwargs):
+        vectors = []
+        for text in texts:
+            key = next((min(group) for group in self.ALIASES if text in group), text)
+            vector = np.random.default_rng(abs(hash(key)) % 2 ** 32).normal(size=DIM)
+            vectors.append(vector / np.linalg.norm(vector))
+        return np.array(vectors)
+
+
+@pytest.fixture
+def linker_factory(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "sentence_transformers", types.SimpleNamespace(SentenceTransformer=StubEncoder))
+    return lambda: EntityLinker(str(tmp_path))
+
+
+def _vectors(count, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(count, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_adds_persist_and_reload(tmp_path):
+    index = EntityIndex(str(tmp_path), "Organization", DIM, initial_capacity=2, snapshot_every=3)
+    vectors = _vectors(5)
+    index.add(["a", "b"], ["A", "B"], vectors[:2])
+    index.add(["c", "d", "e"], ["C", "D", "E"], vectors[2:])
+
+    reloaded = EntityIndex(str(tmp_path), "Organization", DIM)
+
+    assert reloaded.ids == ["a", "b", "c", "d", "e"]
+    assert reloaded.names == ["A", "B", "C", "D", "E"]
+    assert reloaded.index.get_current_count() == 5
+    labels, similarities = reloaded.query(vectors[3:4])
+    assert labels[0][0] == 3
+    assert similarities[0][0] == pytest.approx(1.0, abs=1e-5)
+
+
+def test_reload_replays_entities_added_after_the_snapshot(tmp_path):
+    index = EntityIndex(str(tmp_path), "person", DIM, snapshot_every=2)
+    vectors = _vectors(3)
+    index.add(["a", "b"], ["A", "B"], vectors[:2])
+    index.add(["c"], ["C"], vectors[2:])
+    assert index.snapshot_count == 2
+
+    reloaded = EntityIndex(str(tmp_path), "person", DIM)
+
+    assert reloaded.snapshot_count == 2
+    assert reloaded.index.get_current_count() == 3
+    assert reloaded.query(vectors[2:])[0][0][0] == 2
+
+
+def test_refresh_picks_up_another_workers_adds(tmp_path):
+    vectors = _vectors(3)
+    first = EntityIndex(str(tmp_path), "person", DIM, initial_capacity=1)
+    second = EntityIndex(str(tmp_path), "person", DIM, initial_capacity=1)
+    first.add(["a"], ["A"], vectors[:1])
+
+    assert second.refresh()
+    assert not second.refresh()
+    with second.locked():
+        second.add(["b", "c"], ["B", "C"], vectors[1:])
+    assert first.refresh()
+
+    assert first.ids == second.ids == ["a", "b", "c"]
+    assert first.query(vectors[2:])[0][0][0] == 2
+
+
+def test_snapshot_ahead_of_the_committed_state_is_rebuilt(tmp_path):
+    index = EntityIndex(str(tmp_path), "person", DIM)
+    vectors = _vectors(4)
+    index.add(["a", "b", "c"], ["A", "B", "C"], vectors[:3])
+    # A writer that dies after adding to the ANN index and snapshotting it,
+    # but before committing its entities
+    index.index.add_items(vectors[3:], [3])
+    index.snapshot()
+
+    reloaded = EntityIndex(str(tmp_path), "person", DIM)
+
+    assert reloaded.ids == ["a", "b", "c"]
+    assert reloaded.index.get_current_count() == 3
+
+
+def test_uncommitted_log_records_are_overwritten(tmp_path):
+    index = EntityIndex(str(tmp_path), "person", DIM)
+    vectors = _vectors(2)
+    index.add(["a"], ["A"], vectors[:1])
+    with open(index.log_path, "ab") as f:
+        f.write(b'{"id": "half-written"')
+
+    reloaded = EntityIndex(str(tmp_path), "person", DIM)
+    reloaded.add(["b"], ["B"], vectors[1:])
+
+    assert EntityIndex(str(tmp_path), "person", DIM).ids == ["a", "b"]
+    assert os.path.getsize(index.log_path) == reloaded.log_size
+
+
+def test_link_resolves_aliases_and_remaps_edges(linker_factory):
+    linker = linker_factory()
+    linker.link(GraphBatch([Node("apple", "organization", "Apple")]))
+
+    batch = GraphBatch(
+        [
+            Node("apple-inc.", "organization", "Apple Inc."),
+            Node("tim-cook", "person", "Tim Cook"),
+            Node("timothy-cook", "person", "Timothy Cook"),
+        ],
+        [Edge("timothy-cook", "apple-inc.", "works_at")],
+    )
+    linker.link(batch)
+
+    assert [node.id for node in batch.nodes] == ["apple", "tim-cook", "tim-cook"]
+    assert batch.nodes[0].label == "Apple"
+    assert batch.nodes[2].data["link_score"] == pytest.approx(1.0, abs=1e-5)
+    edge = batch.edges[0]
+    assert (edge.source, edge.target, edge.id) == ("tim-cook", "apple", "tim-cook-apple")
+
+
+def test_second_linker_sees_entities_of_the_first(linker_factory):
+    first, second = linker_factory(), linker_factory()
+    second.link(GraphBatch([Node("x", "organization", "Unrelated")]))
+
+    first.link(GraphBatch([Node("apple", "organization", "Apple")]))
+    batch = second.link(GraphBatch([Node("apple-inc.", "organization", "Apple Inc.")]))
+
+    assert batch.nodes[0].id == "apple"
+    assert second.indexes["organization"].ids == ["x", "apple"]
+
+
+def test_load_indexes_finds_every_type(linker_factory):
+    linker_factory().link(GraphBatch([Node("apple", "organization", "Apple"), Node("tim-cook", "person", "Tim Cook")]))
+
+    linker = linker_factory()
+
+    assert linker.load_indexes() == 2
+    assert sorted(linker.indexes) == ["organization", "person"]
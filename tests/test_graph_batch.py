@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from graph_batch import Edge, GraphBatch, Node
+
+
+@pytest.mark.parametrize("value, stored", [
+    ("text", "text"),
+    (3, 3),
+    (None, None),
+    (["a", "b"], ["a", "b"]),
+    (("a", "b"), ["a", "b"]),
+    ([], []),
+    (["a", 1], json.dumps(["a", 1])),
+    ([True, 2], json.dumps([True, 2])),
+    ([1, 2.5], json.dumps([1, 2.5])),
+    ([{"timestamp": "2024"}], json.dumps([{"timestamp": "2024"}])),
+    ({"nested": 1}, json.dumps({"nested": 1})),
+])
+def test_node_properties_encode_what_stores_cannot_hold(value, stored):
+    assert Node("a", "person", "A", data={"value": value}).properties()["value"] == stored
+
+
+def test_node_properties_round_trip():
+    node = Node("tim-cook", "person", "Tim Cook", "stale", {"tags": ["ceo"], "mention_count": 2})
+
+    properties = node.properties()
+    restored = Node.from_properties(properties)
+
+    assert properties == {
+        "id": "tim-cook", "status": "stale", "type": "person", "label": "Tim Cook", "tags": ["ceo"], "mention_count": 2,
+    }
+    assert (restored.id, restored.type, restored.label, restored.status, restored.data) == (
+        "tim-cook", "person", "Tim Cook", "stale", {"tags": ["ceo"], "mention_count": 2},
+    )
+
+
+def test_edge_properties_round_trip():
+    edge = Edge("tim-cook", "apple", "works_at", data={"score": 0.5})
+
+    properties = edge.properties()
+    restored = Edge.from_properties("tim-cook", "apple", "WorksAt", properties)
+
+    assert properties == {"id": "tim-cook-apple", "status": "active", "type": "directed", "label": "works_at", "score": 0.5}
+    # The stored label wins over the store's mangled relationship type
+    assert (restored.source, restored.target, restored.label, restored.id, restored.data) == (
+        "tim-cook", "apple", "works_at", "tim-cook-apple", {"score": 0.5},
+    )
+    assert Edge.from_properties("a", "b", "RELATED_TO", {}).label == "RELATED_TO"
+
+
+def test_batch_coerce_accepts_batches_dicts_and_json():
+    batch = GraphBatch([Node("a", "person", "A", data={"x": [1]})], [Edge("a", "b", "knows")])
+
+    assert GraphBatch.coerce(batch) is batch
+    for data in (batch.to_dict(), batch.to_json(), batch.to_json().encode()):
+        coerced = GraphBatch.coerce(data)
+        assert coerced.to_dict() == batch.to_dict()
+
+
+def test_from_dict_defaults():
+    batch = GraphBatch.from_dict({"nodes": [{"id": "a"}], "edges": [{"source": "a", "target": "b"}]})
+
+    node, edge = batch.nodes[0], batch.edges[0]
+    assert (node.type, node.label, node.status, node.data) == ("Entity", "", "active", {})
+    assert (edge.label, edge.id, edge.type, edge.status) == ("RELATED_TO", "a-b", "directed", "active")
+    assert batch.node_ids() == {"a"}
+    assert len(batch) == 2
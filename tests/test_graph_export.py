@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from graph_batch import Edge, GraphBatch, Node
+from graph_export import GraphExporter, GraphLoader, LocalStore
+from graph_stats import GraphStats
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class FakeMerger:
+    def __init__(self, batch=None):
+        self.batch = batch or GraphBatch()
+        self.loaded = []
+
+    def iter_nodes(self, page_size):
+        yield self.batch.nodes
+
+    def iter_edges(self, page_size):
+        yield self.batch.edges
+
+    def bulk_upsert(self, batch):
+        self.loaded.append(GraphBatch(list(batch.nodes), list(batch.edges)))
+
+
+def test_load_records_statistics_provenance_and_invalidations(tmp_path):
+    store = LocalStore(str(tmp_path))
+    GraphExporter(FakeMerger(GraphBatch(
+        [Node("apple", "organization", "Apple"), Node("tim-cook", "person", "Tim Cook")],
+        [Edge("tim-cook", "apple", "works_at")],
+    )), store, "snap").export()
+
+    conn = fakeredis.FakeRedis()
+    pubsub = conn.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe("nuner:cache:invalidate")
+    merger = FakeMerger()
+
+    assert GraphLoader(merger, store, "snap", conn).load() == {"nodes": 2, "edges": 1}
+
+    assert [len(batch.nodes) + len(batch.edges) for batch in merger.loaded] == [2, 1]
+    snapshot = GraphStats(conn).snapshot()
+    assert (snapshot["nodes"], snapshot["edges"]) == (2, 1)
+    assert conn.smembers("nuner:sources:node:apple") == {b"snapshot:snap"}
+    assert conn.smembers("nuner:sources:edge:tim-cook\x1fworks_at\x1fapple") == {b"snapshot:snap"}
+    # get_message() also returns None for the ignored subscribe confirmation
+    messages = [pubsub.get_message(timeout=0.1) for _ in range(4)]
+    invalidated = [json.loads(message["data"]) for message in messages if message]
+    assert invalidated == [["apple", "tim-cook"], ["apple", "tim-cook"]]
@@ -0,0 +1,82 @@
+import pytest
+
+from graph_batch import Edge, GraphBatch, Node
+from graph_stats import GraphStats
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class FakeMerger:
+    def __init__(self, batch):
+        self.batch = batch
+
+    def iter_nodes(self, page_size):
+        yield self.batch.nodes
+
+    def iter_edges(self, page_size):
+        yield self.batch.edges
+
+
+def _batch():
+    return GraphBatch(
+        [Node("apple", "organization", "Apple"), Node("tim-cook", "person", "Tim Cook")],
+        [Edge("tim-cook", "apple", "works_at")],
+    )
+
+
+@pytest.fixture
+def stats():
+    return GraphStats(fakeredis.FakeRedis())
+
+
+def test_record_counts_new_elements(stats):
+    stats.record(_batch())
+
+    snapshot = stats.snapshot()
+    assert snapshot["labels"] == {"organization": 1, "person": 1}
+    assert snapshot["relationships"] == {"works_at": 1}
+    assert snapshot["top_degree"] == [{"id": "tim-cook", "degree": 1}, {"id": "apple", "degree": 1}]
+    assert snapshot["ingest_per_minute"]["1m"] == {"batches": 1, "nodes": 2, "edges": 1}
+
+
+def test_record_does_not_count_upserts_twice(stats):
+    stats.record(_batch())
+    stats.record(_batch())
+
+    snapshot = stats.snapshot()
+    assert (snapshot["nodes"], snapshot["edges"]) == (2, 1)
+    assert snapshot["ingest_per_minute"]["1m"]["batches"] == 2
+
+
+def test_record_skips_incomplete_elements(stats):
+    stats.record(GraphBatch([Node(None, "person", "")], [Edge("", "apple", "works_at")]))
+
+    assert (stats.snapshot()["nodes"], stats.snapshot()["edges"]) == (0, 0)
+
+
+def test_reconcile_rebuilds_counters_and_membership(stats):
+    stats.record(_batch())
+    stats.record(GraphBatch([Node("gone", "person", "Gone")]))
+
+    # The backend lost "gone" and gained an edge behind the write path's back
+    graph = _batch()
+    graph.edges.append(Edge("apple", "tim-cook", "employs"))
+    assert stats.reconcile(FakeMerger(graph)) == {"node_drift": -1, "edge_drift": 1}
+
+    snapshot = stats.snapshot()
+    assert snapshot["labels"] == {"organization": 1, "person": 1}
+    assert snapshot["relationships"] == {"works_at": 1, "employs": 1}
+    assert snapshot["last_reconciled"] is not None
+
+    # A later write of a reconciled element is not counted again, a removed one is
+    stats.record(GraphBatch([Node("apple", "organization", "Apple"), Node("gone", "person", "Gone")]))
+    assert stats.snapshot()["labels"] == {"organization": 1, "person": 2}
+
+
+def test_reconcile_empty_graph(stats):
+    stats.record(_batch())
+
+    stats.reconcile(FakeMerger(GraphBatch()))
+
+    snapshot = stats.snapshot()
+    assert (snapshot["nodes"], snapshot["edges"], snapshot["top_degree"]) == (0, 0, [])
@@ -0,0 +1,62 @@
+import pytest
+
+from graph_batch import Edge, GraphBatch, Node
+from manifest import ChunkManifest, Provenance
+
+
+def _entry(hash, nodes, edges=()):
+    return ChunkManifest.entry(hash, GraphBatch([Node(id, "entity", id) for id in nodes], [Edge(*edge) for edge in edges]))
+
+
+def test_diff_first_visit_extracts_every_distinct_chunk():
+    changed, removed = ChunkManifest.diff({}, ["a", "b", "a"])
+
+    assert changed == [0, 1]
+    assert removed == []
+
+
+def test_diff_revisit():
+    previous = {"a": _entry("a", ["x"]), "b": _entry("b", ["y"])}
+
+    changed, removed = ChunkManifest.diff(previous, ["a", "c"])
+
+    assert changed == [1]
+    assert removed == [previous["b"]]
+
+
+def test_entry_is_sorted_and_deduplicated():
+    entry = _entry("a", ["y", "x", "y"], [("y", "x", "knows"), ("x", "y", "knows"), ("x", "y", "knows")])
+
+    assert entry == {"hash": "a", "nodes": ["x", "y"], "edges": [("x", "y", "knows"), ("y", "x", "knows")]}
+
+
+def test_stale_elements_keeps_what_a_remaining_chunk_produces():
+    removed = [_entry("a", ["x", "y"], [("x", "y", "knows"), ("y", "x", "knows")])]
+    entries = [_entry("b", ["y"], [("x", "y", "knows")])]
+
+    nodes, edges = ChunkManifest.stale_elements(removed, entries)
+
+    assert nodes == ["x"]
+    assert edges == [("y", "x", "knows")]
+
+
+def test_stale_elements_accepts_entries_read_back_from_json():
+    removed = [{"hash": "a", "nodes": ["x"], "edges": [["x", "y", "knows"]]}]
+    entries = [{"hash": "b", "nodes": [], "edges": [["x", "y", "knows"]]}]
+
+    assert ChunkManifest.stale_elements(removed, entries) == (["x"], [])
+
+
+def test_provenance_releases_only_unsupported_elements():
+    fakeredis = pytest.importorskip("fakeredis")
+    provenance = Provenance(fakeredis.FakeRedis())
+    batch = GraphBatch([Node("x", "entity", "X"), Node("y", "entity", "Y")], [Edge("x", "y", "knows")])
+
+    provenance.add("nuextract:https://a", batch)
+    provenance.add("nuextract:https://b", GraphBatch([Node("y", "entity", "Y")]))
+
+    nodes, edges = provenance.release("nuextract:https://a", ["x", "y"], [("x", "y", "knows")])
+
+    assert nodes == ["x"]
+    assert edges == [("x", "y", "knows")]
+    assert provenance.release("nuextract:https://b", ["y"], []) == (["y"], [])
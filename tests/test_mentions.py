@@ -0,0 +1,77 @@
+import pytest
+
+from graph_batch import Edge, GraphBatch, Node
+from mentions import aggregate_mentions, fold_salience
+
+
+def _node(id, label, type="organization", score=0.9):
+    return Node(id, type, label, data={"score": score, "chunk_offset": 0})
+
+
+def test_folded_mentions_rewrite_their_edges():
+    batch = GraphBatch(
+        [_node("apple-inc.", "Apple Inc."), _node("apple", "Apple"), _node("tim-cook", "Tim Cook", "person")],
+        [Edge("tim-cook", "apple", "works_at"), Edge("tim-cook", "apple-inc.", "works_at")],
+    )
+
+    id_map = {}
+    batch = aggregate_mentions(batch, id_map)
+
+    assert sorted(node.id for node in batch.nodes) == ["apple-inc.", "tim-cook"]
+    assert id_map == {"apple": "apple-inc."}
+    assert len(batch.edges) == 1
+    edge = batch.edges[0]
+    assert (edge.source, edge.target, edge.id) == ("tim-cook", "apple-inc.", "tim-cook-apple-inc.")
+    assert edge.data["mention_count"] == 2
+
+
+def test_counts_and_scores_fold_by_weight():
+    batch = aggregate_mentions(GraphBatch([_node("apple", "Apple", score=0.5), _node("apple", "apple", score=1.0)]))
+    batch = aggregate_mentions(GraphBatch(batch.nodes + [_node("apple", "Apple", score=0.8)]))
+
+    (node,) = batch.nodes
+    assert node.data["mention_count"] == 3
+    assert node.data["max_score"] == 1.0
+    assert abs(node.data["mean_score"] - 2.3 / 3) < 1e-9
+
+
+def test_id_kept_by_another_type_is_not_remapped():
+    batch = GraphBatch(
+        [_node("apple-inc", "Apple Inc"), _node("apple", "Apple"), _node("apple", "Apple", "product")],
+        [Edge("tim-cook", "apple", "uses")],
+    )
+
+    id_map = {}
+    batch = aggregate_mentions(batch, id_map)
+
+    assert id_map == {}
+    assert batch.edges[0].target == "apple"
+
+
+def test_unscored_mentions_get_no_scores():
+    batch = aggregate_mentions(GraphBatch([Node("apple", "organization", "Apple"), Node("apple", "organization", "Apple")]))
+
+    (node,) = batch.nodes
+    assert node.data == {"mention_count": 2}
+
+
+def test_fold_salience_accumulates_across_ingests():
+    existing = {"mention_count": 3, "max_score": 0.9, "score": 0.9, "mean_score": 0.5, "chunk_offsets": [0, 10]}
+    properties = {"mention_count": 1, "max_score": 0.7, "score": 0.7, "mean_score": 0.7, "chunk_offsets": [40], "label": "Apple"}
+
+    folded = fold_salience(existing, properties)
+
+    assert folded["mention_count"] == 4
+    assert folded["max_score"] == folded["score"] == 0.9
+    assert folded["mean_score"] == pytest.approx(0.55)
+    assert folded["chunk_offsets"] == [40]
+    assert folded["label"] == "Apple"
+
+
+def test_fold_salience_first_ingest_and_unscored():
+    properties = {"mention_count": 2, "mean_score": 0.5}
+
+    assert fold_salience(None, properties) is properties
+    assert fold_salience({"label": "Apple"}, properties) is properties
+    assert fold_salience({"mention_count": 2}, {"mention_count": 1}) == {"mention_count": 3}
+    assert fold_salience({"mention_count": 2}, {"label": "x"}) == {"label": "x"}
@@ -0,0 +1,71 @@
+import re
+
+from predictions import close_json, merge_predictions, parse_prediction, split_windows
+
+
+class WhitespaceTokenizer:
+    # One token per word, enough to exercise the offset arithmetic
+    def __call__(self, text, add_special_tokens=False, return_offsets_mapping=False):
+        return {"offset_mapping": [match.span() for match in re.finditer(r"\S+", text)]}
+
+
+def test_parse_prediction_valid_json():
+    assert parse_prediction('noise {"nodes": [{"name": "Apple"}]}') == {"nodes": [{"name": "Apple"}]}
+
+
+def test_parse_prediction_without_object():
+    assert parse_prediction("no json here") == {}
+    assert parse_prediction("[1, 2]") == {}
+
+
+def test_parse_prediction_recovers_truncated_output():
+    output = '{"nodes": [{"name": "Apple", "type": "organization"}, {"name": "Tim C'
+    assert parse_prediction(output) == {"nodes": [{"name": "Apple", "type": "organization"}]}
+
+
+def test_parse_prediction_drops_trailing_commas():
+    assert parse_prediction('{"nodes": [{"name": "Apple"},], "edges": [],}') == {"nodes": [{"name": "Apple"}], "edges": []}
+
+
+def test_close_json():
+    assert close_json('{"a": [1, {"b": 2}') == '{"a": [1, {"b": 2}]}'
+    assert close_json('{"a": "}]"') == '{"a": "}]"}'
+    assert close_json('{"a": "open') is None
+    assert close_json('{"a": ]') is None
+
+
+def test_split_windows_short_text_is_one_window():
+    assert split_windows(WhitespaceTokenizer(), "one two three", 5, 2) == ["one two three"]
+
+
+def test_split_windows_overlap():
+    text = " ".join(str(i) for i in range(10))
+    windows = split_windows(WhitespaceTokenizer(), text, 4, 1)
+
+    assert windows == ["0 1 2 3", "3 4 5 6", "6 7 8 9"]
+
+
+def test_split_windows_overlap_larger_than_window_still_advances():
+    windows = split_windows(WhitespaceTokenizer(), "a b c", 2, 5)
+
+    assert windows == ["a b", "b c"]
+
+
+def test_merge_predictions_keys_nodes_on_name_and_rewrites_local_ids():
+    batch = merge_predictions([
+        {
+            "nodes": [
+                {"id": "1", "name": "Tim Cook", "type": "Person", "tags": ["ceo"]},
+                {"id": "2", "name": "Apple", "type": "organization"},
+            ],
+            "edges": [{"source": "1", "target": "2", "label": "works_at"}],
+        },
+        {
+            "nodes": [{"id": "7", "name": "Tim Cook", "type": "person", "tags": ["ceo", "board"]}],
+            "edges": [{"source": "7", "target": "Apple", "label": "works_at"}, {"source": "", "target": "7"}],
+        },
+    ])
+
+    assert [(node.type, node.id) for node in batch.nodes] == [("person", "tim-cook"), ("organization", "apple")]
+    assert batch.nodes[0].data["tags"] == ["ceo", "board"]
+    assert [(edge.source, edge.target, edge.label) for edge in batch.edges] == [("tim-cook", "apple", "works_at")]
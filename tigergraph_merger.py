@@ -1,9 +1,15 @@
 import pyTigerGraph as tg
-import json
+from graph_batch import Edge, GraphBatch, Node
+from mentions import fold_salience
 import logging
+import math
+import os
 
 logger = logging.getLogger(__name__)
 
+# Vertices per export query; bounds what one response holds in memory
+export_partition_size = int(os.getenv("TIGERGRAPH_EXPORT_PARTITION_SIZE", "100000"))
+
 class TigerGraphMerger:
     def __init__(self, host, graph_name, username, password):
         self.conn = tg.TigerGraphConnection(host=host, graphname=graph_name, username=username, password=password)
@@ -43,28 +49,31 @@ class TigerGraphMerger:
             raise
 
     def merge_data(self, new_data):
-        data = json.loads(new_data)
+        batch = GraphBatch.coerce(new_data)
         
         # Merge nodes
-        for node in data.get('nodes', []):
+        for node in batch.nodes:
             self._merge_node(node)
 
         # Merge edges
-        for edge in data.get('edges', []):
+        for edge in batch.edges:
             self._merge_edge(edge)
 
     def _merge_node(self, node):
-        node_id = node.get('id')
+        node_id = node.id
         if not node_id:
             logger.warning(f"Skipping node due to missing id: {node}")
             return
         
-        # In TigerGraph, upsert will create or update the vertex
-        self.conn.upsertVertex("node", node_id, node)
+        # In TigerGraph, upsert will create or update the vertex; mention
+        # counts and scores add up over ingests, so read what is there first
+        existing = self.conn.getVerticesById("node", node_id)
+        properties = fold_salience(existing[0]["attributes"] if existing else None, node.properties())
+        self.conn.upsertVertex("node", node_id, properties)
 
     def _merge_edge(self, edge):
-        source = edge.get('source')
-        target = edge.get('target')
+        source = edge.source
+        target = edge.target
         
         if not source or not target:
             logger.warning(f"Skipping edge due to missing source or target: {edge}")
@@ -73,18 +82,140 @@ class TigerGraphMerger:
         edge_id = f"{source}-{target}"
         
         # In TigerGraph, upsert will create or update the edge
-        self.conn.upsertEdge("node", source, "edge", "node", target, edge_id, edge)
+        existing = self.conn.getEdges("node", source, "edge", "node", target)
+        properties = fold_salience(existing[0]["attributes"] if existing else None, edge.properties())
+        self.conn.upsertEdge("node", source, "edge", "node", target, edge_id, properties)
+
+    def bulk_upsert(self, batch):
+        # Restored elements already carry their totals, this overwrites
+        nodes = [(node.id, node.properties()) for node in batch.nodes if node.id]
+        edges = [(edge.source, edge.target, edge.properties()) for edge in batch.edges if edge.source and edge.target]
+        if nodes:
+            self.conn.upsertVertices("node", nodes)
+        if edges:
+            self.conn.upsertEdges("node", "edge", "node", edges)
+
+    def _partitions(self, query, page_size):
+        # GSQL has no cursor, and keyset pages re-sort every vertex per page.
+        # Instead every vertex falls in one of a few hash partitions on its
+        # internal id (as pyTigerGraph's own loaders do); each query is a
+        # plain filtered scan without sorting, and its result is handed on
+        # page_size records at a time.
+        parts = max(1, math.ceil(self.conn.getVertexCount("node") / export_partition_size))
+        for part in range(parts):
+            result = self.conn.runInterpretedQuery(query, params={"parts": parts, "part": part})[0]
+            records = next(iter(result.values()))
+            for start in range(0, len(records), page_size):
+                yield records[start:start + page_size]
+
+    def iter_nodes(self, page_size=1000):
+        query = f'''
+        INTERPRET QUERY (INT parts, INT part) FOR GRAPH {self.graph_name} {{
+          Start = {{node.*}};
+          Part = SELECT s FROM Start:s WHERE getvid(s) % parts == part;
+          PRINT Part;
+        }}'''
+        for page in self._partitions(query, page_size):
+            yield [Node.from_properties({**vertex['attributes'], 'id': vertex['v_id']}) for vertex in page]
+
+    def iter_edges(self, page_size=1000):
+        # Each undirected edge is reported from its smaller endpoint only
+        query = f'''
+        INTERPRET QUERY (INT parts, INT part) FOR GRAPH {self.graph_name} {{
+          SetAccum<EDGE> @@edges;
+          Start = {{node.*}};
+          Part = SELECT s FROM Start:s WHERE getvid(s) % parts == part;
+          Linked = SELECT t FROM Part:s -(edge:e)- node:t WHERE s.id <= t.id ACCUM @@edges += e;
+          PRINT @@edges;
+        }}'''
+        for page in self._partitions(query, page_size):
+            yield [
+                Edge.from_properties(edge['from_id'], edge['to_id'], edge['attributes'].get('label'), edge['attributes'])
+                for edge in page
+            ]
 
-    def search(self, query):
-        # This is a basic implementation. You might want to adjust based on your specific needs
+    def mark_stale(self, node_ids, edges):
+        if node_ids:
+            self.conn.upsertVertices("node", [(node_id, {"status": "stale"}) for node_id in node_ids])
+        for source, target, label in edges:
+            self.conn.upsertEdge("node", source, "edge", "node", target, {"label": label, "status": "stale"})
+
+    def search(self, query, limit=25):
+        # The query comes straight from HTTP, so it is bound as a parameter
+        # and never becomes part of the GSQL text
         gsql_query = f'''
-        INTERPRET QUERY () FOR GRAPH {self.graph_name} {{
+        INTERPRET QUERY (STRING pattern, INT lim) FOR GRAPH {self.graph_name} {{
           StartVertex = {{node.*}};
-          PRINT StartVertex WHERE toLowerCase(to_string(StartVertex)) LIKE "%{query.lower()}%";
+          Matches = SELECT v FROM StartVertex:v WHERE lower(v.id) LIKE pattern LIMIT lim;
+          PRINT Matches;
         }}'''
         
-        result = self.conn.runInterpretedQuery(gsql_query)
-        return result[0]['StartVertex']
+        result = self.conn.runInterpretedQuery(gsql_query, params={"pattern": f"%{query.lower()}%", "lim": int(limit)})
+        return [vertex['attributes'] for vertex in result[0]['Matches']]
+
+    def _edges(self, node_id):
+        return [
+            {**edge['attributes'], 'source': edge['from_id'], 'target': edge['to_id']}
+            for edge in self.conn.getEdges("node", node_id)
+        ]
+
+    def _nodes(self, node_ids):
+        if not node_ids:
+            return []
+        return [vertex['attributes'] for vertex in self.conn.getVerticesById("node", list(node_ids))]
+
+    def neighbourhood(self, node_id, depth=1, limit=200):
+        seen = {node_id}
+        frontier = [node_id]
+        edges = {}
+        for _ in range(depth):
+            next_frontier = []
+            for vertex_id in frontier:
+                # Every vertex is a REST call, stop expanding once the result is full
+                if len(edges) >= limit:
+                    break
+                for edge in self._edges(vertex_id):
+                    if len(edges) >= limit:
+                        break
+                    edges.setdefault((edge['source'], edge['target'], edge.get('label')), edge)
+                    for other in (edge['source'], edge['target']):
+                        if other not in seen:
+                            seen.add(other)
+                            next_frontier.append(other)
+            frontier = next_frontier
+
+        return {"nodes": self._nodes(seen), "edges": list(edges.values())}
+
+    def path(self, source, target, max_depth=4, max_vertices=2000):
+        # Breadth-first over the REST edge listing, remembering how each vertex
+        # was reached. A hub can put most of the graph within a few hops, so
+        # the number of vertices expanded (one request each) is capped too.
+        parents = {source: None}
+        frontier = [source]
+        expanded = 0
+        for _ in range(max_depth):
+            next_frontier = []
+            for vertex_id in frontier:
+                if expanded >= max_vertices:
+                    logger.warning(f"Gave up on path {source} -> {target} after {expanded} vertices")
+                    return {"nodes": [], "edges": []}
+                expanded += 1
+                for edge in self._edges(vertex_id):
+                    other = edge['target'] if edge['source'] == vertex_id else edge['source']
+                    if other in parents:
+                        continue
+                    parents[other] = (vertex_id, edge)
+                    if other == target:
+                        node_ids, edges = [other], []
+                        while parents[other] is not None:
+                            other, edge = parents[other]
+                            node_ids.append(other)
+                            edges.append(edge)
+                        return {"nodes": self._nodes(node_ids[::-1]), "edges": edges[::-1]}
+                    next_frontier.append(other)
+            frontier = next_frontier
+
+        return {"nodes": [], "edges": []}
 
     def visualize(self):
         # This is a placeholder for visualization logic